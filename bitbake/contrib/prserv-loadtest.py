@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+# Load test for the PR service: a number of client processes, standing in
+# for build machines, send getPR (or batched getPRs) requests to a server
+# and the request latencies are reported. Unless --host is given, a
+# server with a temporary database is started for the test.
+#
+import os
+import sys
+import optparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), '../lib'))
+import prserv.serv
+
+def client(args):
+    """
+    Send the requests of one client, returning the latency of each
+    """
+    host, port, clientnum, requests, batch, recipes = args
+    conn = prserv.serv.PRServerConnection(host, port)
+    latencies = []
+    sent = 0
+    while sent < requests:
+        queries = []
+        for i in range(min(batch, requests - sent)):
+            # A mix of previously seen and new checksums, as with builds
+            # which share most of their tasks
+            recipe = (sent + i) % recipes
+            checksum = "%s-%s" % (recipe, (sent + i) % 3 or clientnum)
+            queries.append(("1.0-r0", "arch%s" % (recipe % 4), checksum))
+        start = time.time()
+        if batch > 1:
+            conn.getPRs(queries)
+        else:
+            conn.getPR(*queries[0])
+        latencies.append(time.time() - start)
+        sent = sent + len(queries)
+    return latencies
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+def main():
+    parser = optparse.OptionParser(usage = "%prog [options]")
+    parser.add_option("--host", help="PR server to test (default: start a local one)",
+                      action="store", dest="host", type="string")
+    parser.add_option("--port", help="PR server port", action="store",
+                      dest="port", type="int", default=8585)
+    parser.add_option("-c", "--clients", help="number of client processes (default: 40)",
+                      action="store", dest="clients", type="int", default=40)
+    parser.add_option("-n", "--requests", help="number of queries per client (default: 200)",
+                      action="store", dest="requests", type="int", default=200)
+    parser.add_option("-b", "--batch", help="queries per getPRs request, 1 to use getPR (default: 1)",
+                      action="store", dest="batch", type="int", default=1)
+    parser.add_option("-r", "--recipes", help="number of distinct recipes (default: 500)",
+                      action="store", dest="recipes", type="int", default=500)
+    parser.add_option("-t", "--threads", help="handler threads of the local server (default: %d)" % prserv.serv.HANDLER_THREADS,
+                      action="store", dest="threads", type="int", default=prserv.serv.HANDLER_THREADS)
+
+    options, args = parser.parse_args(sys.argv)
+
+    tempdir = None
+    server = None
+    host, port = options.host, options.port
+    if not host:
+        tempdir = tempfile.mkdtemp(prefix="prserv-loadtest")
+        server = prserv.serv.PRServer(os.path.join(tempdir, "prserv.sqlite3"),
+                                      os.path.join(tempdir, "prserv.log"),
+                                      ("localhost", 0), daemon=False, threads=options.threads)
+        server.start()
+        server.socket.close()
+        host, port = server.getinfo()
+
+    try:
+        pool = multiprocessing.Pool(options.clients)
+        start = time.time()
+        results = pool.map(client, [(host, port, i, options.requests, max(options.batch, 1), options.recipes)
+                                    for i in range(options.clients)])
+        elapsed = time.time() - start
+        pool.close()
+        pool.join()
+    finally:
+        if server:
+            prserv.serv.PRServerConnection(host, port).terminate()
+            os.waitpid(server.pid, 0)
+            shutil.rmtree(tempdir)
+
+    latencies = sorted(l for result in results for l in result)
+    queries = options.clients * options.requests
+    print("%d clients, %d queries in %d requests in %.2fs (%.0f queries/s)" %
+          (options.clients, queries, len(latencies), elapsed, queries / elapsed))
+    print("request latency: p50 %.1fms, p99 %.1fms, max %.1fms" %
+          (percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+"""
+BitBake task admission control
+
+Decides whether the runqueue may start another task, based on per-class
+resource budgets and on the live load and free memory of the build host.
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import time
+import bb
+from bb.monitordisk import convertGMK
+
+logger = logging.getLogger("BitBake.Admission")
+
+def read_loadavg():
+    """ Return the one minute load average of the host, or None """
+    try:
+        with open("/proc/loadavg", "r") as f:
+            return float(f.read().split()[0])
+    except (EnvironmentError, ValueError, IndexError):
+        return None
+
+def read_memavailable():
+    """ Return the memory available on the host in bytes, or None """
+    meminfo = {}
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    meminfo[fields[0].rstrip(":")] = int(fields[1]) * 1024
+    except (EnvironmentError, ValueError):
+        return None
+    if "MemAvailable" in meminfo:
+        return meminfo["MemAvailable"]
+    if "MemFree" in meminfo:
+        # Kernels before 3.14 don't provide an estimate
+        return meminfo["MemFree"] + meminfo.get("Buffers", 0) + meminfo.get("Cached", 0)
+    return None
+
+class TaskAdmission(object):
+    """
+    Admission controller for RunQueueExecuteTasks.
+
+    Tasks may be given a resource class and weight with the resource_class
+    and resource_weight task flags, e.g.:
+
+        do_compile[resource_class] = "cpu"
+        do_compile[resource_weight] = "4"
+
+    BB_RESOURCE_BUDGET limits the total weight of running tasks per class,
+    e.g. "cpu:16 io:4". A task whose weight alone exceeds its class budget
+    can still run when no other task of that class is running.
+
+    If BB_LOADAVG_MAX or BB_MEMFREE_MIN are set, no new tasks are started
+    while the host load is above or the available memory below them (bar a
+    single task so the build always progresses). When the host is below
+    both limits and BB_NUMBER_THREADS_MAX is greater than BB_NUMBER_THREADS,
+    the number of tasks is allowed to grow by one every check interval up
+    to BB_NUMBER_THREADS_MAX.
+    """
+
+    # Minimum number of seconds between reads of the host state
+    interval = 1.0
+
+    def __init__(self, rqexec, cfgData):
+        self.rqdata = rqexec.rqdata
+        self.number_tasks = rqexec.number_tasks
+
+        self.budgets = {}
+        for entry in (cfgData.getVar("BB_RESOURCE_BUDGET", True) or "").split():
+            try:
+                resclass, budget = entry.split(":")
+                self.budgets[resclass] = int(budget)
+            except ValueError:
+                bb.fatal("Invalid BB_RESOURCE_BUDGET entry '%s', expected <class>:<budget>" % entry)
+
+        max_tasks = cfgData.getVar("BB_NUMBER_THREADS_MAX", True)
+        try:
+            self.max_tasks = int(max_tasks or self.number_tasks)
+        except ValueError:
+            bb.fatal("Invalid BB_NUMBER_THREADS_MAX value '%s', expected an integer" % max_tasks)
+
+        self.loadavg_max = cfgData.getVar("BB_LOADAVG_MAX", True)
+        if self.loadavg_max:
+            try:
+                self.loadavg_max = float(self.loadavg_max)
+            except ValueError:
+                bb.fatal("Invalid BB_LOADAVG_MAX value '%s', expected a number" % self.loadavg_max)
+
+        self.memfree_min = cfgData.getVar("BB_MEMFREE_MIN", True)
+        if self.memfree_min:
+            memfree_min = convertGMK(self.memfree_min)
+            if memfree_min is None:
+                bb.fatal("Invalid BB_MEMFREE_MIN value '%s'" % self.memfree_min)
+            self.memfree_min = memfree_min
+
+        self.usage = {}
+        self.running = {}
+
+        # The (resource class, weight) of each task, checked up front rather
+        # than failing part way through the build
+        self.resources = []
+        for task in xrange(len(self.rqdata.runq_fnid)):
+            fn = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[task]]
+            taskname = self.rqdata.runq_task[task]
+            taskdep = self.rqdata.dataCache.task_deps[fn]
+            resclass = taskdep.get('resource_class', {}).get(taskname)
+            weight = taskdep.get('resource_weight', {}).get(taskname)
+            try:
+                weight = int(weight or 1)
+            except ValueError:
+                bb.fatal("Invalid resource_weight '%s' for task %s of %s, expected an integer" % (weight, taskname, fn))
+            self.resources.append((resclass, weight))
+
+        self.pressure = False
+        self.boost = 0
+        self.lastcheck = None
+
+    def task_resources(self, task):
+        """ Return the (resource class, weight) of a task """
+        return self.resources[task]
+
+    def check_host(self):
+        """
+        Refresh the host pressure state and boost, at most once per interval
+        """
+        if not (self.loadavg_max or self.memfree_min):
+            return
+        now = time.time()
+        if self.lastcheck is not None and now - self.lastcheck < self.interval:
+            return
+        self.lastcheck = now
+
+        pressure = False
+        if self.loadavg_max:
+            loadavg = read_loadavg()
+            if loadavg is not None and loadavg > self.loadavg_max:
+                pressure = True
+        if self.memfree_min:
+            memavailable = read_memavailable()
+            if memavailable is not None and memavailable < self.memfree_min:
+                pressure = True
+
+        if pressure != self.pressure:
+            logger.debug(1, "Host resource pressure %s", "detected, throttling tasks" if pressure else "cleared")
+        self.pressure = pressure
+
+        if pressure:
+            self.boost = 0
+        elif self.boost < self.max_tasks - self.number_tasks:
+            self.boost = self.boost + 1
+
+    def max_active(self):
+        """ Return the number of tasks which may currently be running """
+        self.check_host()
+        if self.pressure:
+            return 1
+        return self.number_tasks + self.boost
+
+    def can_start(self, task):
+        """ Return whether the resource class budget allows task to start """
+        resclass, weight = self.task_resources(task)
+        if resclass not in self.budgets:
+            return True
+        used = self.usage.get(resclass, 0)
+        return used == 0 or used + weight <= self.budgets[resclass]
+
+    def task_started(self, task):
+        resclass, weight = self.task_resources(task)
+        self.running[task] = (resclass, weight)
+        self.usage[resclass] = self.usage.get(resclass, 0) + weight
+
+    def task_finished(self, task):
+        if task in self.running:
+            resclass, weight = self.running.pop(task)
+            self.usage[resclass] = self.usage[resclass] - weight
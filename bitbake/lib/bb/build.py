@@ -734,6 +734,8 @@ def add_tasks(tasklist, d):
         getTask('fakeroot')
         getTask('noexec')
         getTask('umask')
+        getTask('resource_class')
+        getTask('resource_weight')
         task_deps['parents'][task] = []
         if 'deps' in flags:
             for dep in flags['deps']:
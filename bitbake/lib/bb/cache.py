@@ -31,6 +31,7 @@
 
 import os
 import logging
+import struct
 from collections import defaultdict
 import bb.utils
 
@@ -43,15 +44,78 @@ except ImportError:
     logger.info("Importing cPickle failed. "
                 "Falling back to a very slow implementation.")
 
-__cache_version__ = "149"
+__cache_version__ = "153"
 
 def getCacheFile(path, filename, data_hash):
     return os.path.join(path, filename + "." + data_hash)
 
+def intern_data(value):
+    """
+    Return value with any strings in it, including those nested in lists,
+    tuples and dicts, replaced by their interned copies
+    """
+    if type(value) is str:
+        return intern(value)
+    if type(value) is list:
+        return [intern_data(v) for v in value]
+    if type(value) is tuple:
+        return tuple(intern_data(v) for v in value)
+    if type(value) is dict:
+        return dict((intern_data(k), intern_data(v)) for k, v in value.iteritems())
+    return value
+
+_slotnames = {}
+
+def slotnames(cls):
+    """
+    Return the names of the slots of cls and all its base classes
+    """
+    if cls not in _slotnames:
+        names = []
+        for base in reversed(cls.__mro__):
+            slots = base.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots
+                         if name not in ("__dict__", "__weakref__") and name not in names)
+        _slotnames[cls] = tuple(names)
+    return _slotnames[cls]
+
 # RecipeInfoCommon defines common data retrieving methods
 # from meta data for caches. CoreRecipeInfo as well as other
 # Extra RecipeInfo needs to inherit this class
+#
+# RecipeInfo classes list their attributes in __slots__, so the many
+# thousands of instances don't each carry an attribute dict. The same
+# package, provider and dependency names occur in most recipes, so these
+# are interned when the objects are unpickled from the cache or received
+# from the parsing processes, leaving one copy of each string in the cooker.
+# Extra cache classes without __slots__ of their own keep their attributes
+# in __dict__ as before, which is pickled along with the slots.
 class RecipeInfoCommon(object):
+    __slots__ = ()
+
+    def __getstate__(self):
+        # Pickle a tuple of values rather than a dict keyed by attribute
+        # name. Skipped recipes leave most attributes unset, so the set
+        # ones are recorded in a bitmask.
+        present = 0
+        values = []
+        for i, name in enumerate(slotnames(type(self))):
+            if hasattr(self, name):
+                present |= 1 << i
+                values.append(getattr(self, name))
+        return (present, values, getattr(self, "__dict__", None))
+
+    def __setstate__(self, state):
+        present, values, attrs = state
+        values = iter(values)
+        for i, name in enumerate(slotnames(type(self))):
+            if present & (1 << i):
+                setattr(self, name, intern_data(next(values)))
+        if attrs:
+            for name, value in attrs.iteritems():
+                setattr(self, name, intern_data(value))
 
     @classmethod
     def listvar(cls, var, metadata):
@@ -90,7 +154,14 @@ class RecipeInfoCommon(object):
 
 
 class CoreRecipeInfo(RecipeInfoCommon):
-    __slots__ = ()
+    __slots__ = ('file_depends', 'timestamp', 'variants', 'appends', 'nocache',
+                 'skipreason', 'pn', 'skipped', 'provides', 'rprovides', 'tasks',
+                 'packages', 'basetaskhashes', 'hashfilename', 'task_deps', 'pe',
+                 'pv', 'pr', 'defaultpref', 'not_world', 'stamp', 'stampclean',
+                 'stamp_extrainfo', 'file_checksums', 'packages_dynamic', 'depends',
+                 'rdepends', 'rrecommends', 'rprovides_pkg', 'rdepends_pkg',
+                 'rrecommends_pkg', 'inherits', 'fakerootenv', 'fakerootdirs',
+                 'fakerootnoenv', 'extradepsfunc')
 
     cachefile = "bb_cache.dat"   
 
@@ -252,6 +323,204 @@ class CoreRecipeInfo(RecipeInfoCommon):
 
 
 
+class RecipeInfoFile(object):
+    """
+    Indexed on-disk store for the pickled RecipeInfo objects of one
+    cache class.
+
+    The file starts with a fixed size header giving the location of the
+    index, followed by one pickled record per virtual filename. The index
+    is a pickle of the cache and bitbake versions, a dict mapping virtual
+    filenames to the (offset, length) of their records and the number of
+    bytes in the file which are no longer referenced. Records are only read
+    and unpickled when requested.
+
+    Saving appends the changed records and a new index to the file and then
+    rewrites the header, so an interrupted save leaves the previous index
+    in place. Once more than half of the file is unreferenced, the live
+    records are copied into a new file instead.
+    """
+
+    MAGIC = "BBCACHE1"
+    HEADER = struct.Struct("!8sQQ")
+
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.close()
+        self.index = {}
+        self.dead = 0
+        self.indexoffset = None
+        self.indexsize = 0
+
+    def close(self):
+        if getattr(self, "fd", None):
+            self.fd.close()
+        self.fd = None
+
+    def filesize(self):
+        if self.fd is None:
+            return 0
+        return os.fstat(self.fd.fileno()).st_size
+
+    def load(self):
+        """
+        Read the header and index of the file, returning None on success
+        or the reason the file can't be used
+        """
+        self.reset()
+        try:
+            fd = open(self.path, "rb")
+        except IOError:
+            return "Invalid cache"
+
+        try:
+            magic, offset, length = self.HEADER.unpack(fd.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                raise ValueError("Unknown cache format")
+            fd.seek(offset)
+            cache_ver, bitbake_ver, index, dead = pickle.loads(fd.read(length))
+        except Exception:
+            fd.close()
+            return "Invalid cache"
+
+        if cache_ver != __cache_version__:
+            fd.close()
+            return "Cache version mismatch"
+        elif bitbake_ver != bb.__version__:
+            fd.close()
+            return "Bitbake version mismatch"
+
+        self.fd = fd
+        self.index = index
+        self.dead = dead
+        self.indexoffset = offset
+        self.indexsize = length
+        return None
+
+    def read(self, key):
+        """Return the pickled record for key"""
+        offset, length = self.index[key]
+        self.fd.seek(offset)
+        return self.fd.read(length)
+
+    def get(self, key):
+        return pickle.loads(self.read(key))
+
+    def save(self, records, removed):
+        """
+        Store the RecipeInfo objects in the records dict, replacing any
+        existing records for their keys, and drop the keys in removed
+        """
+        index = dict(self.index)
+        dead = self.dead + self.indexsize
+        for key in set(removed) | set(records):
+            if key in index:
+                dead = dead + index.pop(key)[1]
+
+        pickled = [(key, pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+                   for key, info in records.iteritems()]
+        live = sum(length for _, length in index.itervalues())
+        live = live + sum(len(data) for _, data in pickled)
+
+        lf = bb.utils.lockfile(self.path + ".lock")
+        try:
+            if self.fd is None or dead > live or not self.unchanged():
+                self.rewrite(index, pickled)
+            else:
+                self.append(index, pickled, dead)
+        finally:
+            bb.utils.unlockfile(lf)
+
+    def unchanged(self):
+        """Check no other process saved the file since it was loaded"""
+        try:
+            with open(self.path, "rb") as f:
+                magic, offset, length = self.HEADER.unpack(f.read(self.HEADER.size))
+        except (IOError, struct.error):
+            return False
+        return offset == self.indexoffset and os.path.samestat(os.fstat(self.fd.fileno()), os.stat(self.path))
+
+    def append(self, index, pickled, dead):
+        with open(self.path, "r+b") as f:
+            # Anything after the current index was left by an interrupted save
+            f.seek(self.indexoffset + self.indexsize)
+            self.write_records(f, index, pickled, dead)
+
+    def rewrite(self, index, pickled):
+        tmpfile = "%s.%s" % (self.path, os.getpid())
+        with open(tmpfile, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, 0, 0))
+            newindex = {}
+            for key, (_, length) in index.iteritems():
+                newindex[key] = (f.tell(), length)
+                f.write(self.read(key))
+            self.write_records(f, newindex, pickled, 0)
+        os.rename(tmpfile, self.path)
+
+    def write_records(self, f, index, pickled, dead):
+        for key, data in pickled:
+            index[key] = (f.tell(), len(data))
+            f.write(data)
+        offset = f.tell()
+        data = pickle.dumps([__cache_version__, bb.__version__, index, dead], pickle.HIGHEST_PROTOCOL)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(self.HEADER.pack(self.MAGIC, offset, len(data)))
+
+class RecipeInfoIndex(object):
+    """
+    Mapping of virtual filenames to their RecipeInfo arrays, backed by
+    the RecipeInfoFile stores of each cache class.
+
+    Entries present on disk are only loaded on first access. Entries which
+    are set or deleted are recorded so that only those need to be written
+    when the cache is saved.
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.loaded = {}
+        self.dirty = set()
+        self.removed = set()
+        self.ondisk = set()
+        if stores:
+            self.ondisk = set(stores[0].index)
+            for store in stores[1:]:
+                self.ondisk.intersection_update(store.index)
+
+    def __contains__(self, key):
+        return key in self.loaded or key in self.ondisk
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            if key not in self.ondisk:
+                raise KeyError(key)
+            self.loaded[key] = [store.get(key) for store in self.stores]
+        return self.loaded[key]
+
+    def __setitem__(self, key, info_array):
+        if self.loaded.get(key) is not info_array:
+            self.dirty.add(key)
+        self.removed.discard(key)
+        self.loaded[key] = info_array
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.loaded.pop(key, None)
+        self.ondisk.discard(key)
+        self.dirty.discard(key)
+        self.removed.add(key)
+
+    def __len__(self):
+        return len(self.ondisk.union(self.loaded))
+
 class Cache(object):
     """
     BitBake Cache implementation
@@ -265,7 +534,8 @@ class Cache(object):
         self.cachedir = data.getVar("CACHE", True)
         self.clean = set()
         self.checked = set()
-        self.depends_cache = {}
+        self.stores = []
+        self.depends_cache = RecipeInfoIndex(self.stores)
         self.data = None
         self.data_fn = None
         self.cacheclean = True
@@ -290,68 +560,34 @@ class Cache(object):
                     cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
                     cache_ok = cache_ok and os.path.exists(cachefile)
                     cache_class.init_cacheData(self)
+                    self.stores.append(RecipeInfoFile(cachefile))
         if cache_ok:
             self.load_cachefile()
         elif os.path.isfile(self.cachefile):
             logger.info("Out of date cache found, rebuilding...")
 
     def load_cachefile(self):
-        # Firstly, using core cache file information for
-        # valid checking
-        with open(self.cachefile, "rb") as cachefile:
-            pickled = pickle.Unpickler(cachefile)
-            try:
-                cache_ver = pickled.load()
-                bitbake_ver = pickled.load()
-            except Exception:
-                logger.info('Invalid cache, rebuilding...')
-                return
-
-            if cache_ver != __cache_version__:
-                logger.info('Cache version mismatch, rebuilding...')
-                return
-            elif bitbake_ver != bb.__version__:
-                logger.info('Bitbake version mismatch, rebuilding...')
-                return
-
-
+        # Only the indexes are read here, the recipe information itself
+        # is loaded from the cache files as it is accessed
         cachesize = 0
-        previous_progress = 0
-        previous_percent = 0
-
-        # Calculate the correct cachesize of all those cache files
-        for cache_class in self.caches_array:
-            if type(cache_class) is type and issubclass(cache_class, RecipeInfoCommon):
-                cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
-                with open(cachefile, "rb") as cachefile:
-                    cachesize += os.fstat(cachefile.fileno()).st_size
+        for store in self.stores:
+            cachesize += os.path.getsize(store.path)
 
         bb.event.fire(bb.event.CacheLoadStarted(cachesize), self.data)
-        
-        for cache_class in self.caches_array:
-            if type(cache_class) is type and issubclass(cache_class, RecipeInfoCommon):
-                cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
-                with open(cachefile, "rb") as cachefile:
-                    pickled = pickle.Unpickler(cachefile)                    
-                    while cachefile:
-                        try:
-                            key = pickled.load()
-                            value = pickled.load()
-                        except Exception:
-                            break
-                        if self.depends_cache.has_key(key):
-                            self.depends_cache[key].append(value)
-                        else:
-                            self.depends_cache[key] = [value]
-                        # only fire events on even percentage boundaries
-                        current_progress = cachefile.tell() + previous_progress
-                        current_percent = 100 * current_progress / cachesize
-                        if current_percent > previous_percent:
-                            previous_percent = current_percent
-                            bb.event.fire(bb.event.CacheLoadProgress(current_progress, cachesize),
-                                          self.data)
-
-                    previous_progress += current_progress
+
+        current_progress = 0
+        for store in self.stores:
+            reason = store.load()
+            if reason:
+                logger.info('%s, rebuilding...', reason)
+                for store in self.stores:
+                    store.reset()
+                break
+            current_progress += store.filesize()
+            bb.event.fire(bb.event.CacheLoadProgress(current_progress, cachesize),
+                          self.data)
+
+        self.depends_cache = RecipeInfoIndex(self.stores)
 
         # Note: depends cache number is corresponding to the parsing file numbers.
         # The same file has several caches, still regarded as one item in the cache
@@ -359,7 +595,6 @@ class Cache(object):
                                                   len(self.depends_cache)),
                       self.data)
 
-    
     @staticmethod
     def virtualfn2realfn(virtualfn):
         """
@@ -603,30 +838,15 @@ class Cache(object):
             logger.debug(2, "Cache is clean, not saving.")
             return
 
-        file_dict = {}
-        pickler_dict = {}
-        for cache_class in self.caches_array:
-            if type(cache_class) is type and issubclass(cache_class, RecipeInfoCommon):
-                cache_class_name = cache_class.__name__
-                cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
-                file_dict[cache_class_name] = open(cachefile, "wb")
-                pickler_dict[cache_class_name] =  pickle.Pickler(file_dict[cache_class_name], pickle.HIGHEST_PROTOCOL)
-                   
-        pickler_dict['CoreRecipeInfo'].dump(__cache_version__)
-        pickler_dict['CoreRecipeInfo'].dump(bb.__version__)
-
-        try:
-            for key, info_array in self.depends_cache.iteritems():
-                for info in info_array:
-                    if isinstance(info, RecipeInfoCommon):
-                        cache_class_name = info.__class__.__name__
-                        pickler_dict[cache_class_name].dump(key)
-                        pickler_dict[cache_class_name].dump(info)
-        finally:
-            for cache_class in self.caches_array:
-                if type(cache_class) is type and issubclass(cache_class, RecipeInfoCommon):
-                    cache_class_name = cache_class.__name__
-                    file_dict[cache_class_name].close()
+        # The stores are in the same order as the RecipeInfo arrays
+        for i, store in enumerate(self.stores):
+            records = {}
+            for key in self.depends_cache.dirty:
+                records[key] = self.depends_cache.loaded[key][i]
+            try:
+                store.save(records, self.depends_cache.removed)
+            finally:
+                store.close()
 
         del self.depends_cache
 
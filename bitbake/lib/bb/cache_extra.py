@@ -28,7 +28,9 @@
 from bb.cache import RecipeInfoCommon
 
 class HobRecipeInfo(RecipeInfoCommon):
-    __slots__ = ()
+    __slots__ = ('summary', 'license', 'section',
+            'description', 'homepage', 'bugtracker',
+            'prevision', 'files_info')
 
     classname = "HobRecipeInfo"
     # please override this member with the correct data cache file
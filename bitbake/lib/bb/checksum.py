@@ -16,12 +16,14 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import glob
+import multiprocessing
 import operator
 import os
 import stat
 import bb.utils
 import logging
 from bb.cache import MultiProcessCache
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger("BitBake.Cache")
 
@@ -58,62 +60,121 @@ class FileMtimeCache(object):
     def clear(self):
         self.cache.clear()
 
-# Checksum + mtime cache (persistent)
+# Checksum + stat cache (persistent)
 class FileChecksumCache(MultiProcessCache):
     cache_file_name = "local_file_checksum_cache.dat"
-    CACHE_VERSION = 1
+    CACHE_VERSION = 2
 
     def __init__(self):
-        self.mtime_cache = FileMtimeCache()
+        # Stat results, non-persistent and based upon the assumption that
+        # files do not change during the bitbake run (like FileMtimeCache)
+        self.stat_cache = {}
+        self.threads = multiprocessing.cpu_count()
         MultiProcessCache.__init__(self)
 
+    def init_cache(self, d, cache_file_name=None):
+        self.stat_cache = {}
+        self.threads = int(d.getVar("BB_NUMBER_THREADS", True) or self.threads)
+        MultiProcessCache.init_cache(self, d, cache_file_name)
+
+    def file_key(self, f):
+        """
+        Return the key a cached checksum of f is valid for. Unlike the mtime
+        alone this catches files replaced in the same second.
+        """
+        if f not in self.stat_cache:
+            st = os.stat(f)
+            self.stat_cache[f] = (st.st_ino, st.st_size, st.st_mtime)
+        return self.stat_cache[f]
+
     def get_checksum(self, f):
+        key = self.file_key(f)
         entry = self.cachedata[0].get(f)
-        cmtime = self.mtime_cache.cached_mtime(f)
         if entry:
-            (mtime, hashval) = entry
-            if cmtime == mtime:
+            (cachedkey, hashval) = entry
+            if cachedkey == key:
                 return hashval
             else:
-                bb.debug(2, "file %s changed mtime, recompute checksum" % f)
+                bb.debug(2, "file %s changed, recompute checksum" % f)
 
         hashval = bb.utils.md5_file(f)
-        self.cachedata_extras[0][f] = (cmtime, hashval)
+        self.cachedata_extras[0][f] = (key, hashval)
         return hashval
 
     def merge_data(self, source, dest):
         for h in source[0]:
             if h in dest:
-                (smtime, _) = source[0][h]
-                (dmtime, _) = dest[0][h]
-                if smtime > dmtime:
+                (skey, _) = source[0][h]
+                (dkey, _) = dest[0][h]
+                if skey[2] > dkey[2]:
                     dest[0][h] = source[0][h]
             else:
                 dest[0][h] = source[0][h]
 
-    def get_checksums(self, filelist, pn):
-        """Get checksums for a list of files"""
-
-        def checksum_file(f):
+    def checksum_files(self, files, pn):
+        """
+        Return a dict of file -> checksum (None if the file can't be read)
+        for the files given. Files without a valid cache entry are
+        checksummed in parallel.
+        """
+        results = {}
+        todo = []
+        for f in files:
+            if f in results:
+                continue
             try:
-                checksum = self.get_checksum(f)
+                key = self.file_key(f)
             except OSError as e:
                 bb.warn("Unable to get checksum for %s SRC_URI entry %s: %s" % (pn, os.path.basename(f), e))
-                return None
-            return checksum
+                results[f] = None
+                continue
+            entry = self.cachedata[0].get(f)
+            if entry and entry[0] == key:
+                results[f] = entry[1]
+                continue
+            if entry:
+                bb.debug(2, "file %s changed, recompute checksum" % f)
+            results[f] = None
+            todo.append((f, key))
+
+        def checksum_file(item):
+            try:
+                return bb.utils.md5_file(item[0])
+            except OSError as e:
+                return e
 
-        def checksum_dir(pth):
+        if len(todo) > 1 and self.threads > 1:
+            pool = ThreadPool(min(len(todo), self.threads))
+            try:
+                hashvals = pool.map(checksum_file, todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            hashvals = map(checksum_file, todo)
+
+        for (f, key), hashval in zip(todo, hashvals):
+            if isinstance(hashval, OSError):
+                bb.warn("Unable to get checksum for %s SRC_URI entry %s: %s" % (pn, os.path.basename(f), hashval))
+                continue
+            self.cachedata_extras[0][f] = (key, hashval)
+            results[f] = hashval
+
+        return results
+
+    def get_checksums(self, filelist, pn):
+        """Get checksums for a list of files"""
+
+        # Collect (file, from a directory) entries first so anything which
+        # needs checksumming can be handled in one parallel batch
+        entries = []
+
+        def add_dir(pth):
             # Handle directories recursively
-            dirchecksums = []
             for root, dirs, files in os.walk(pth):
                 for name in files:
-                    fullpth = os.path.join(root, name)
-                    checksum = checksum_file(fullpth)
-                    if checksum:
-                        dirchecksums.append((fullpth, checksum))
-            return dirchecksums
+                    entries.append((os.path.join(root, name), True))
 
-        checksums = []
         for pth in filelist.split():
             exist = pth.split(":")[1]
             if exist == "False":
@@ -124,16 +185,24 @@ class FileChecksumCache(MultiProcessCache):
                 for f in glob.glob(pth):
                     if os.path.isdir(f):
                         if not os.path.islink(f):
-                            checksums.extend(checksum_dir(f))
+                            add_dir(f)
                     else:
-                        checksum = checksum_file(f)
-                        checksums.append((f, checksum))
+                        entries.append((f, False))
             elif os.path.isdir(pth):
                 if not os.path.islink(pth):
-                    checksums.extend(checksum_dir(pth))
+                    add_dir(pth)
             else:
-                checksum = checksum_file(pth)
-                checksums.append((pth, checksum))
+                entries.append((pth, False))
+
+        results = self.checksum_files([f for f, _ in entries], pn)
+
+        checksums = []
+        for f, fromdir in entries:
+            checksum = results[f]
+            # Unreadable files within directories are left out
+            if fromdir and not checksum:
+                continue
+            checksums.append((f, checksum))
 
         checksums.sort(key=operator.itemgetter(1))
         return checksums
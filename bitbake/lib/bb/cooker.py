@@ -43,6 +43,11 @@ import errno
 import prserv.serv
 import pyinotify
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 logger      = logging.getLogger("BitBake")
 collectlog  = logging.getLogger("BitBake.Collection")
 buildlog    = logging.getLogger("BitBake.Build")
@@ -1706,6 +1711,7 @@ class CookerCollectFiles(object):
     def __init__(self, priorities):
         self.bbappends = []
         self.bbfile_config_priorities = priorities
+        self.index_bbappends()
 
     def calc_bbfile_priority( self, filename, matched = None ):
         for _, _, regex, pri in self.bbfile_config_priorities:
@@ -1813,6 +1819,7 @@ class CookerCollectFiles(object):
         for f in bbappend:
             base = os.path.basename(f).replace('.bbappend', '.bb')
             self.bbappends.append((base, f))
+        self.index_bbappends()
 
         # Find overlayed recipes
         # bbfiles will be in priority order which makes this easy
@@ -1828,17 +1835,53 @@ class CookerCollectFiles(object):
 
         return (bbfiles, masked)
 
+    def index_bbappends(self):
+        """
+        Index self.bbappends for get_file_appends(). Appends without a
+        wildcard are looked up by name, those with a '%' wildcard are stored
+        in a trie of the characters before the '%'. Each trie node is a
+        list of a dict of child nodes and the positions in self.bbappends
+        of the appends whose prefix ends at that node.
+        """
+        self.bbappends_exact = defaultdict(list)
+        self.bbappends_trie = [{}, []]
+        for i, (bbappend, _) in enumerate(self.bbappends):
+            if '%' not in bbappend:
+                self.bbappends_exact[bbappend].append(i)
+                continue
+            node = self.bbappends_trie
+            for c in bbappend[:bbappend.index('%')]:
+                node = node[0].setdefault(c, [{}, []])
+            node[1].append(i)
+        self.appends_cache = {}
+
     def get_file_appends(self, fn):
         """
         Returns a list of .bbappend files to apply to fn
         """
-        filelist = []
         f = os.path.basename(fn)
-        for b in self.bbappends:
-            (bbappend, filename) = b
-            if (bbappend == f) or ('%' in bbappend and bbappend.startswith(f[:bbappend.index('%')])):
-                filelist.append(filename)
-        return filelist
+        if f not in self.appends_cache:
+            matches = list(self.bbappends_exact.get(f, []))
+            # A wildcard append applies when the recipe name starts with the
+            # part before the '%'
+            node = self.bbappends_trie
+            matches.extend(node[1])
+            for c in f:
+                node = node[0].get(c)
+                if node is None:
+                    break
+                matches.extend(node[1])
+            else:
+                # Matching the longer prefixes of which the whole name is a
+                # prefix mirrors the startswith() check this replaced
+                stack = node[0].values()
+                while stack:
+                    node = stack.pop()
+                    matches.extend(node[1])
+                    stack.extend(node[0].values())
+            # Keep the order of self.bbappends
+            self.appends_cache[f] = [self.bbappends[i][1] for i in sorted(set(matches))]
+        return list(self.appends_cache[f])
 
     def collection_priorities(self, pkgfns, d):
 
@@ -1880,35 +1923,6 @@ class ParsingFailure(Exception):
         self.recipe = recipe
         Exception.__init__(self, realexception, recipe)
 
-class Feeder(multiprocessing.Process):
-    def __init__(self, jobs, to_parsers, quit):
-        self.quit = quit
-        self.jobs = jobs
-        self.to_parsers = to_parsers
-        multiprocessing.Process.__init__(self)
-
-    def run(self):
-        while True:
-            try:
-                quit = self.quit.get_nowait()
-            except Queue.Empty:
-                pass
-            else:
-                if quit == 'cancel':
-                    self.to_parsers.cancel_join_thread()
-                break
-
-            try:
-                job = self.jobs.pop()
-            except IndexError:
-                break
-
-            try:
-                self.to_parsers.put(job, timeout=0.5)
-            except Queue.Full:
-                self.jobs.insert(0, job)
-                continue
-
 class Parser(multiprocessing.Process):
     def __init__(self, jobs, results, quit, init, profile):
         self.jobs = jobs
@@ -1941,32 +1955,25 @@ class Parser(multiprocessing.Process):
         if self.init:
             self.init()
 
-        pending = []
         while True:
-            try:
-                self.quit.get_nowait()
-            except Queue.Empty:
-                pass
-            else:
-                self.results.cancel_join_thread()
+            # Block until a batch of jobs is available, the queue always
+            # ends with one None per parser
+            chunk = self.jobs.get()
+            if chunk is None:
                 break
 
-            if pending:
-                result = pending.pop()
-            else:
+            for filename, appends, caches_array in chunk:
                 try:
-                    job = self.jobs.get(timeout=0.25)
+                    self.quit.get_nowait()
                 except Queue.Empty:
-                    continue
-
-                if job is None:
-                    break
-                result = self.parse(*job)
+                    pass
+                else:
+                    self.results.cancel_join_thread()
+                    return
 
-            try:
-                self.results.put(result, timeout=0.25)
-            except Queue.Full:
-                pending.append(result)
+                start = time.time()
+                parsed, result = self.parse(filename, appends, caches_array)
+                self.results.put((parsed, result, filename, self.name, time.time() - start))
 
     def parse(self, filename, appends, caches_array):
         try:
@@ -1981,7 +1988,12 @@ class Parser(multiprocessing.Process):
             bb.event.set_class_handlers(self.handlers.copy())
             bb.event.LogHandler.filter = parse_filter
 
-            return True, bb.cache.Cache.parse(filename, appends, self.cfg, caches_array)
+            result = bb.cache.Cache.parse(filename, appends, self.cfg, caches_array)
+            stats = bb.data_smart.expand_cache_stats
+            if stats:
+                parselog.debug(1, "Expansion cache for %s: %s", filename, stats)
+                stats.reset()
+            return True, result
         except Exception as exc:
             tb = sys.exc_info()[2]
             exc.recipe = filename
@@ -1994,6 +2006,9 @@ class Parser(multiprocessing.Process):
             return True, ParsingFailure(exc, filename)
 
 class CookerParser(object):
+    # Maximum number of recipes sent to a parser process at once
+    chunksize = 16
+
     def __init__(self, cooker, filelist, masked):
         self.filelist = filelist
         self.cooker = cooker
@@ -2023,6 +2038,15 @@ class CookerParser(object):
             else:
                 self.fromcache.append((filename, appends))
         self.toparse = self.total - len(self.fromcache)
+
+        # Parse the recipes which took longest last time first so they don't
+        # hold up the end of parsing. Recipes without a recorded time are
+        # assumed to take the average time.
+        self.parsetimes = self.load_parsetimes()
+        if self.parsetimes:
+            average = sum(self.parsetimes.itervalues()) / len(self.parsetimes)
+            self.willparse.sort(key=lambda job: self.parsetimes.get(job[0], average), reverse=True)
+        self.workerstats = {}
         self.progress_chunk = max(self.toparse / 100, 1)
 
         self.num_processes = min(int(self.cfgdata.getVar("BB_NUMBER_PARSE_THREADS", True) or
@@ -2037,17 +2061,25 @@ class CookerParser(object):
         if self.toparse:
             bb.event.fire(bb.event.ParseStarted(self.toparse), self.cfgdata)
             def init():
+                # The global INHERITs are already part of cfgdata (see
+                # parseBaseConfiguration), each recipe is parsed from a
+                # copy of it. Flattening it into a per process snapshot
+                # first measured no faster and costs a copy per process.
                 Parser.cfg = self.cfgdata
+                if self.cfgdata.getVar("BB_EXPANDCACHE_STATS", True) == "1":
+                    bb.data_smart.enable_expand_cache_stats()
                 bb.utils.set_process_name(multiprocessing.current_process().name)
                 multiprocessing.util.Finalize(None, bb.codeparser.parser_cache_save, exitpriority=1)
                 multiprocessing.util.Finalize(None, bb.fetch.fetcher_parse_save, exitpriority=1)
 
-            self.feeder_quit = multiprocessing.Queue(maxsize=1)
             self.parser_quit = multiprocessing.Queue(maxsize=self.num_processes)
-            self.jobs = multiprocessing.Queue(maxsize=self.num_processes)
+            self.jobs = multiprocessing.Queue()
             self.result_queue = multiprocessing.Queue()
-            self.feeder = Feeder(self.willparse, self.jobs, self.feeder_quit)
-            self.feeder.start()
+            for chunk in self.chunks():
+                self.jobs.put(chunk)
+            for i in range(0, self.num_processes):
+                self.jobs.put(None)
+            self.parse_start = time.time()
             for i in range(0, self.num_processes):
                 parser = Parser(self.jobs, self.result_queue, self.parser_quit, init, self.cooker.configuration.profile)
                 parser.start()
@@ -2067,15 +2099,15 @@ class CookerParser(object):
             event = bb.event.ParseCompleted(self.cached, self.parsed,
                                             self.skipped, self.masked,
                                             self.virtuals, self.error,
-                                            self.total)
+                                            self.total, self.worker_utilization())
 
             bb.event.fire(event, self.cfgdata)
-            self.feeder_quit.put(None)
+            for worker, (recipes, busy, utilization) in sorted(event.utilization.iteritems()):
+                parselog.debug(1, "%s parsed %d recipes in %.2fs (%d%% utilization)",
+                               worker, recipes, busy, utilization * 100)
             for process in self.processes:
                 self.parser_quit.put(None)
         else:
-            self.feeder_quit.put('cancel')
-
             self.parser_quit.cancel_join_thread()
             for process in self.processes:
                 self.parser_quit.put(None)
@@ -2088,7 +2120,8 @@ class CookerParser(object):
                 process.terminate()
             else:
                 process.join()
-        self.feeder.join()
+
+        self.save_parsetimes()
 
         sync = threading.Thread(target=self.bb_cache.sync)
         sync.start()
@@ -2111,21 +2144,66 @@ class CookerParser(object):
             cached, infos = self.bb_cache.load(filename, appends, self.cfgdata)
             yield not cached, infos
 
+    def chunks(self):
+        """
+        Split the recipes to parse into batches for the parser processes.
+        Batches shrink towards the end of the list so the parsers finish
+        at around the same time.
+        """
+        jobs = self.willparse
+        i = 0
+        while i < len(jobs):
+            size = max(1, min(self.chunksize, (len(jobs) - i) // (self.num_processes * 4)))
+            yield jobs[i:i+size]
+            i += size
+
+    def load_parsetimes(self):
+        if not self.bb_cache.has_cache:
+            return {}
+        try:
+            with open(os.path.join(self.bb_cache.cachedir, "bb_parsetimes.dat"), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return {}
+
+    def save_parsetimes(self):
+        if not self.bb_cache.has_cache:
+            return
+        parsetimes = os.path.join(self.bb_cache.cachedir, "bb_parsetimes.dat")
+        filelist = set(self.filelist)
+        times = dict((fn, t) for fn, t in self.parsetimes.iteritems() if fn in filelist)
+        try:
+            with open(parsetimes + ".new", "wb") as f:
+                pickle.dump(times, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(parsetimes + ".new", parsetimes)
+        except EnvironmentError as exc:
+            logger.debug(1, "Unable to save recipe parse times: %s", exc)
+
+    def worker_utilization(self):
+        """
+        Return a dict mapping each parser process to the number of recipes
+        it parsed, the time it spent parsing them and the fraction of the
+        parsing time this represents
+        """
+        elapsed = max(time.time() - self.parse_start, 1e-6)
+        utilization = {}
+        for worker, (recipes, busy) in self.workerstats.iteritems():
+            utilization[worker] = (recipes, busy, busy / elapsed)
+        return utilization
+
     def parse_generator(self):
         while True:
             if self.parsed >= self.toparse:
                 break
 
-            try:
-                result = self.result_queue.get(timeout=0.25)
-            except Queue.Empty:
-                pass
-            else:
-                value = result[1]
-                if isinstance(value, BaseException):
-                    raise value
-                else:
-                    yield result
+            parsed, value, filename, worker, elapsed = self.result_queue.get()
+            if isinstance(value, BaseException):
+                raise value
+
+            self.parsetimes[filename] = elapsed
+            recipes, busy = self.workerstats.get(worker, (0, 0.0))
+            self.workerstats[worker] = (recipes + 1, busy + elapsed)
+            yield parsed, value
 
     def parse_next(self):
         result = []
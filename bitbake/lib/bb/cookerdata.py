@@ -314,6 +314,8 @@ class CookerDataBuilder(object):
         for p in postfiles:
             data = parse_config_file(p, data)
 
+        bb.parse.BBHandler.init_statement_cache(data)
+
         # Handle any INHERITs and inherit the base class
         bbclasses  = ["base"] + (data.getVar('INHERIT', True) or "").split()
         for bbclass in bbclasses:
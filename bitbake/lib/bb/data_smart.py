@@ -42,6 +42,32 @@ __setvar_keyword__ = ["_append", "_prepend", "_remove"]
 __setvar_regexp__ = re.compile('(?P<base>.*?)(?P<keyword>_append|_prepend|_remove)(_(?P<add>.*))?$')
 __expand_var_regexp__ = re.compile(r"\${[^{}@\n\t :]+}")
 __expand_python_regexp__ = re.compile(r"\${@.+?}")
+# Internal variables get_hash() includes, their order is not significant
+__hash_lists__ = ["__BBTASKS", "__BBANONFUNCS", "__BBHANDLERS"]
+
+class ExpandCacheStats(object):
+    """Hit and invalidation counters for the expansion caches"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return "%s hits, %s misses (%.1f%% hit rate), %s entries invalidated" % (
+            self.hits, self.misses, 100.0 * self.hits / max(lookups, 1), self.invalidated)
+
+# Set by enable_expand_cache_stats(), counting costs time so is off by default
+expand_cache_stats = None
+
+def enable_expand_cache_stats():
+    global expand_cache_stats
+    if expand_cache_stats is None:
+        expand_cache_stats = ExpandCacheStats()
+    return expand_cache_stats
 
 def infer_caller_details(loginfo, parent = False, varval = True):
     """Save the caller the trouble of specifying everything."""
@@ -98,6 +124,9 @@ class VariableParse:
         self.references = set()
         self.execs = set()
         self.contains = {}
+        # Python expressions can depend on more than the references we
+        # know about so their expansions only stay cached until any write
+        self.volatile = False
 
     def var_sub(self, match):
             key = match.group()[2:-1]
@@ -107,6 +136,8 @@ class VariableParse:
             if key in self.d.expand_cache:
                 varparse = self.d.expand_cache[key]
                 var = varparse.value
+                if expand_cache_stats:
+                    expand_cache_stats.hits += 1
             else:
                 var = self.d.getVarFlag(key, "_content", True)
             self.references.add(key)
@@ -118,6 +149,7 @@ class VariableParse:
     def python_sub(self, match):
             code = match.group()[3:-1]
             codeobj = compile(code.strip(), self.varname or "<expansion>", "eval")
+            self.volatile = True
 
             parser = bb.codeparser.PythonParser(self.varname, logger)
             parser.parse_python(code)
@@ -353,7 +385,19 @@ class DataSmart(MutableMapping):
         self.varhistory = VariableHistory(self)
         self._tracking = False
 
+        # Cached expansions, the cache keys depending on each variable and
+        # the keys whose expansion ran python code
         self.expand_cache = {}
+        self.expand_deps = {}
+        self.expand_volatile = set()
+        # The overrides the cached expansions were made with
+        self.expand_overrides = None
+
+        # Per variable digests for get_hash(), their XOR and the variables
+        # written since they were calculated
+        self.hashdigests = {}
+        self.hashtotal = 0
+        self.hashdirty = None
 
         # cookie monster tribute
         # Need to be careful about writes to overridedata as
@@ -376,6 +420,8 @@ class DataSmart(MutableMapping):
             return VariableParse(varname, self, s)
 
         if varname and varname in self.expand_cache:
+            if expand_cache_stats:
+                expand_cache_stats.hits += 1
             return self.expand_cache[varname]
 
         varparse = VariableParse(varname, self)
@@ -403,10 +449,74 @@ class DataSmart(MutableMapping):
         varparse.value = s
 
         if varname:
+            if expand_cache_stats:
+                expand_cache_stats.misses += 1
             self.expand_cache[varname] = varparse
+            self._expand_cache_depends(varname, varparse.references, varparse.volatile)
 
         return varparse
 
+    def _expand_cache_depends(self, key, references, volatile):
+        """
+        Record that the cached expansion key (a variable name or var[flag])
+        depends on the variables in references
+        """
+        deps = self.expand_deps
+        for ref in references:
+            if ref in deps:
+                deps[ref].add(key)
+            else:
+                deps[ref] = set([key])
+        base = key.split("[", 1)[0]
+        if base in deps:
+            deps[base].add(key)
+        else:
+            deps[base] = set([key])
+        if volatile:
+            self.expand_volatile.add(key)
+
+    def _expand_cache_invalidate(self, var, flag = None):
+        """
+        Drop the cached expansions which may depend on var, or only on the
+        given non-internal flag of var if flag is set, along with any
+        expansions depending on those in turn
+        """
+        cache = self.expand_cache
+        if not cache:
+            return
+        if flag:
+            todo = [var + "[" + flag + "]"]
+        else:
+            # The value of FOO also comes from FOO_<override>, FOO_append and
+            # friends so writes to those invalidate FOO as well
+            todo = [var]
+            while "_" in var:
+                var = var[:var.rfind("_")]
+                todo.append(var)
+        todo.extend(self.expand_volatile)
+        self.expand_volatile = set()
+
+        deps = self.expand_deps
+        invalidated = 0
+        while todo:
+            name = todo.pop()
+            if name in cache:
+                del cache[name]
+                invalidated += 1
+            if name in deps:
+                todo.extend(deps.pop(name))
+        if expand_cache_stats:
+            expand_cache_stats.invalidated += invalidated
+
+    def _expand_cache_clear(self):
+        self.expand_cache = {}
+        self.expand_deps = {}
+        self.expand_volatile = set()
+
+    def _hash_invalidate(self, var):
+        if self.hashdirty is not None:
+            self.hashdirty.add(var)
+
     def expand(self, s, varname = None):
         return self.expandWithRefs(s, varname).value
 
@@ -424,13 +534,20 @@ class DataSmart(MutableMapping):
             return
         for count in range(5):
             self.inoverride = True
-            # Can end up here recursively so setup dummy values
+            # Can end up here recursively so setup dummy values. Expansions
+            # made with them go to a scratch cache which is then discarded.
+            cache = self.expand_cache
+            self.expand_cache = {}
             self.overrides = []
             self.overridesset = set()
             self.overrides = (self.getVar("OVERRIDES", True) or "").split(":") or []
             self.overridesset = set(self.overrides)
             self.inoverride = False
-            self.expand_cache = {}
+            self.expand_cache = cache
+            # Cached expansions remain valid while the overrides are unchanged
+            if self.overrides != self.expand_overrides:
+                self._expand_cache_clear()
+                self.expand_overrides = self.overrides
             newoverrides = (self.getVar("OVERRIDES", True) or "").split(":") or []
             if newoverrides == self.overrides:
                 break
@@ -440,7 +557,6 @@ class DataSmart(MutableMapping):
             bb.fatal("Overrides could not be expanded into a stable state after 5 iterations, overrides must be being referenced by other overridden variables in some recursive fashion. Please provide your configuration to bitbake-devel so we can laugh, er, I mean try and understand how to make it work.")
 
     def initVar(self, var):
-        self.expand_cache = {}
         if not var in self.dict:
             self.dict[var] = {}
 
@@ -474,7 +590,8 @@ class DataSmart(MutableMapping):
 
         if 'op' not in loginfo:
             loginfo['op'] = "set"
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var)
+        self._hash_invalidate(var)
         match  = __setvar_regexp__.match(var)
         if match and match.group("keyword") in __setvar_keyword__:
             base = match.group('base')
@@ -536,6 +653,8 @@ class DataSmart(MutableMapping):
 
     def _setvar_update_overridevars(self, var, value):
         vardata = self.expandWithRefs(value, var)
+        # Don't leave the expansion of value alone cached as that of var
+        self._expand_cache_invalidate(var)
         new = vardata.references
         new.update(vardata.contains.keys())
         while not new.issubset(self.overridevars):
@@ -591,6 +710,7 @@ class DataSmart(MutableMapping):
             self.setVarFlag(newkey, i, dest, ignore=True)
 
         if key in self.overridedata:
+            self._expand_cache_invalidate(newkey)
             self.overridedata[newkey] = []
             for (v, o) in self.overridedata[key]:
                 self.overridedata[newkey].append([v.replace(key, newkey), o])
@@ -619,7 +739,8 @@ class DataSmart(MutableMapping):
         loginfo['detail'] = ""
         loginfo['op'] = 'del'
         self.varhistory.record(**loginfo)
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var)
+        self._hash_invalidate(var)
         self.dict[var] = {}
         if var in self.overridedata:
             del self.overridedata[var]
@@ -642,7 +763,8 @@ class DataSmart(MutableMapping):
                          override = None
 
     def setVarFlag(self, var, flag, value, **loginfo):
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var, None if flag.startswith("_") else flag)
+        self._hash_invalidate(var)
         if 'op' not in loginfo:
             loginfo['op'] = "set"
         loginfo['flag'] = flag
@@ -659,6 +781,7 @@ class DataSmart(MutableMapping):
         if flag == "unexport" or flag == "export":
             if not "__exportlist" in self.dict:
                 self._makeShadowCopy("__exportlist")
+            self._expand_cache_invalidate("__exportlist")
             if not "_content" in self.dict["__exportlist"]:
                 self.dict["__exportlist"]["_content"] = set()
             self.dict["__exportlist"]["_content"].add(var)
@@ -739,6 +862,8 @@ class DataSmart(MutableMapping):
 
         if value and flag == "_content" and local_var is not None and "_remove" in local_var:
             removes = []
+            removerefs = set()
+            removevolatile = False
             self.need_overrides()
             for (r, o) in local_var["_remove"]:
                 match = True
@@ -747,7 +872,10 @@ class DataSmart(MutableMapping):
                         if not o2 in self.overrides:
                             match = False                            
                 if match:
-                    removes.extend(self.expand(r).split())
+                    varparse = self.expandWithRefs(r, None)
+                    removes.extend(varparse.value.split())
+                    removerefs |= varparse.references
+                    removevolatile = removevolatile or varparse.volatile
 
             filtered = filter(lambda v: v not in removes,
                               value.split())
@@ -756,10 +884,12 @@ class DataSmart(MutableMapping):
                  # We need to ensure the expand cache has the correct value
                  # flag == "_content" here
                 self.expand_cache[var].value = value
+                self._expand_cache_depends(var, removerefs, removevolatile)
         return value
 
     def delVarFlag(self, var, flag, **loginfo):
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var, None if flag.startswith("_") else flag)
+        self._hash_invalidate(var)
         local_var = self._findVar(var)
         if not local_var:
             return
@@ -789,7 +919,8 @@ class DataSmart(MutableMapping):
         self.setVarFlag(var, flag, newvalue, ignore=True)
 
     def setVarFlags(self, var, flags, **loginfo):
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var)
+        self._hash_invalidate(var)
         infer_caller_details(loginfo)
         if not var in self.dict:
             self._makeShadowCopy(var)
@@ -819,7 +950,8 @@ class DataSmart(MutableMapping):
 
 
     def delVarFlags(self, var, **loginfo):
-        self.expand_cache = {}
+        self._expand_cache_invalidate(var)
+        self._hash_invalidate(var)
         if not var in self.dict:
             self._makeShadowCopy(var)
 
@@ -932,38 +1064,52 @@ class DataSmart(MutableMapping):
     def __delitem__(self, var):
         self.delVar(var)
 
-    def get_hash(self):
-        data = {}
-        d = self.createCopy()
-        bb.data.expandKeys(d)
-        bb.data.update_data(d)
-
-        config_whitelist = set((d.getVar("BB_HASHCONFIG_WHITELIST", True) or "").split())
-        keys = set(key for key in iter(d) if not key.startswith("__"))
-        for key in keys:
-            if key in config_whitelist:
-                continue
-
-            value = d.getVar(key, False) or ""
-            data.update({key:value})
-
-            varflags = d.getVarFlags(key, internalflags = True)
-            if not varflags:
-                continue
-            for f in varflags:
-                if f == "_content":
-                    continue
-                data.update({'%s[%s]' % (key, f):varflags[f]})
-
-        for key in ["__BBTASKS", "__BBANONFUNCS", "__BBHANDLERS"]:
-            bb_list = d.getVar(key, False) or []
-            bb_list.sort()
-            data.update({key:str(bb_list)})
+    def _hash_digest(self, var):
+        """
+        Return the digest of the contents and flags of var, or 0 if var is
+        unset or doesn't count towards get_hash()
+        """
+        if var.startswith("__") and var not in __hash_lists__ and not var.startswith("__anon"):
+            return 0
+        local_var = self._findVar(var)
+        if not local_var:
+            return 0
+        items = []
+        for flag in sorted(local_var):
+            value = local_var[flag]
+            if flag == "_content" and var in __hash_lists__:
+                value = sorted(value)
+            items.append((flag, value))
+        return int(hashlib.md5("%s\0%s" % (var, items)).hexdigest(), 16)
 
-            if key == "__BBANONFUNCS":
-                for i in bb_list:
-                    value = d.getVar(i, False) or ""
-                    data.update({i:value})
+    def get_hash(self):
+        """
+        Return a hash of the unexpanded contents of the datastore, excluding
+        the variables in BB_HASHCONFIG_WHITELIST and internal variables
+        other than the task, anonymous function and handler lists.
 
-        data_str = str([(k, data[k]) for k in sorted(data.keys())])
-        return hashlib.md5(data_str).hexdigest()
+        Each variable's digest is kept and the digests are combined with
+        XOR, so after the first call only variables written through this
+        datastore since the previous call are rehashed.
+        """
+        if self.hashdirty is None:
+            dirty = set()
+            dest = self.dict
+            while dest:
+                dirty.update(dest)
+                dest = dest.get("_data")
+            dirty.discard("_data")
+        else:
+            dirty = self.hashdirty
+        self.hashdirty = set()
+
+        for var in dirty:
+            digest = self._hash_digest(var)
+            self.hashtotal ^= self.hashdigests.pop(var, 0) ^ digest
+            if digest:
+                self.hashdigests[var] = digest
+
+        total = self.hashtotal
+        for var in set((self.getVar("BB_HASHCONFIG_WHITELIST", True) or "").split()):
+            total ^= self.hashdigests.get(var, 0)
+        return hashlib.md5("%032x" % total).hexdigest()
@@ -452,7 +452,7 @@ class ParseStarted(OperationStarted):
 
 class ParseCompleted(OperationCompleted):
     """Recipe parsing for the runqueue has completed"""
-    def __init__(self, cached, parsed, skipped, masked, virtuals, errors, total):
+    def __init__(self, cached, parsed, skipped, masked, virtuals, errors, total, utilization=None):
         OperationCompleted.__init__(self, total, "Recipe parsing Completed")
         self.cached = cached
         self.parsed = parsed
@@ -461,6 +461,9 @@ class ParseCompleted(OperationCompleted):
         self.masked = masked
         self.errors = errors
         self.sofar = cached + parsed
+        # Maps each parser process name to a tuple of the number of recipes
+        # it parsed, the seconds it spent parsing and its utilization (0-1)
+        self.utilization = utilization or {}
 
 class ParseProgress(OperationProgress):
     """Recipe parsing progress"""
@@ -500,6 +503,16 @@ class TreeDataPreparationCompleted(OperationCompleted):
     def __init__(self, total):
         OperationCompleted.__init__(self, total, "Preparing tree data Completed")
 
+class TaskHashesCalculated(Event):
+    """
+    Task hashes for the runqueue have been calculated. timings maps each
+    part of the calculation (and "total") to the seconds spent in it.
+    """
+    def __init__(self, total, timings):
+        Event.__init__(self)
+        self.total = total
+        self.timings = timings
+
 class DepTreeGenerated(Event):
     """
     Event when a dependency tree has been generated
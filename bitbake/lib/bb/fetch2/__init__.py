@@ -30,6 +30,8 @@ from __future__ import print_function
 import os, re
 import signal
 import logging
+import multiprocessing
+import Queue
 import urllib
 import urlparse
 import bb.persist_data, bb.utils
@@ -430,7 +432,7 @@ def encodeurl(decoded):
 
     return url
 
-def uri_replace(ud, uri_find, uri_replace, replacements, d):
+def uri_replace(ud, uri_find, uri_replace, replacements, d, mirrortarball=None):
     if not ud.url or not uri_find or not uri_replace:
         logger.error("uri_replace: passed an undefined value, not replacing")
         return None
@@ -439,6 +441,8 @@ def uri_replace(ud, uri_find, uri_replace, replacements, d):
     uri_replace_decoded = list(decodeurl(uri_replace))
     logger.debug(2, "For url %s comparing %s to %s" % (uri_decoded, uri_find_decoded, uri_replace_decoded))
     result_decoded = ['', '', '', '', '', {}]
+    if mirrortarball is None:
+        mirrortarball = ud.mirrortarball
     for loc, i in enumerate(uri_find_decoded):
         result_decoded[loc] = uri_decoded[loc]
         regexp = i
@@ -469,9 +473,9 @@ def uri_replace(ud, uri_find, uri_replace, replacements, d):
             if loc == 2:
                 # Handle path manipulations
                 basename = None
-                if uri_decoded[0] != uri_replace_decoded[0] and ud.mirrortarball:
+                if uri_decoded[0] != uri_replace_decoded[0] and mirrortarball:
                     # If the source and destination url types differ, must be a mirrortarball mapping
-                    basename = os.path.basename(ud.mirrortarball)
+                    basename = os.path.basename(mirrortarball)
                     # Kill parameters, they make no sense for mirror tarballs
                     uri_decoded[5] = {}
                 elif ud.localpath and ud.method.supports_checksum(ud):
@@ -565,15 +569,13 @@ def verify_checksum(ud, d, precomputed={}):
     if ud.ignore_checksums or not ud.method.supports_checksum(ud):
         return {}
 
-    if _MD5_KEY in precomputed:
-        md5data = precomputed[_MD5_KEY]
-    else:
-        md5data = bb.utils.md5_file(ud.localpath)
-
-    if _SHA256_KEY in precomputed:
-        sha256data = precomputed[_SHA256_KEY]
-    else:
-        sha256data = bb.utils.sha256_file(ud.localpath)
+    # Compute whichever checksums weren't precomputed in one pass
+    checksums = dict(precomputed)
+    missing = [key for key in (_MD5_KEY, _SHA256_KEY) if key not in checksums]
+    if missing:
+        checksums.update(bb.utils.multi_hash_file(ud.localpath, missing))
+    md5data = checksums[_MD5_KEY]
+    sha256data = checksums[_SHA256_KEY]
 
     if ud.method.recommends_checksum(ud) and not ud.md5_expected and not ud.sha256_expected:
         # If strict checking enabled and neither sum defined, raise error
@@ -874,37 +876,41 @@ def build_mirroruris(origud, mirrors, ld):
                 (find, replace) = line
             except ValueError:
                 continue
-            newuri = uri_replace(ud, find, replace, replacements, ld)
-            if not newuri or newuri in uris or newuri == origud.url:
-                continue
 
-            if not trusted_network(ld, newuri):
-                logger.debug(1, "Mirror %s not in the list of trusted networks, skipping" %  (newuri))
-                continue
+            # Some fetchers offer more than one mirror tarball, in order of
+            # preference, so try each of them against this mirror
+            for tarball in ud.mirrortarballs or [None]:
+                newuri = uri_replace(ud, find, replace, replacements, ld, tarball)
+                if not newuri or newuri in uris or newuri == origud.url:
+                    continue
 
-            # Create a local copy of the mirrors minus the current line
-            # this will prevent us from recursively processing the same line
-            # as well as indirect recursion A -> B -> C -> A
-            localmirrors = list(mirrors)
-            localmirrors.remove(line)
+                if not trusted_network(ld, newuri):
+                    logger.debug(1, "Mirror %s not in the list of trusted networks, skipping" %  (newuri))
+                    continue
+
+                # Create a local copy of the mirrors minus the current line
+                # this will prevent us from recursively processing the same line
+                # as well as indirect recursion A -> B -> C -> A
+                localmirrors = list(mirrors)
+                localmirrors.remove(line)
 
-            try:
-                newud = FetchData(newuri, ld)
-                newud.setup_localpath(ld)
-            except bb.fetch2.BBFetchException as e:
-                logger.debug(1, "Mirror fetch failure for url %s (original url: %s)" % (newuri, origud.url))
-                logger.debug(1, str(e))
                 try:
-                    # setup_localpath of file:// urls may fail, we should still see 
-                    # if mirrors of the url exist
-                    adduri(newud, uris, uds, localmirrors)
-                except UnboundLocalError:
-                    pass
-                continue   
-            uris.append(newuri)
-            uds.append(newud)
+                    newud = FetchData(newuri, ld)
+                    newud.setup_localpath(ld)
+                except bb.fetch2.BBFetchException as e:
+                    logger.debug(1, "Mirror fetch failure for url %s (original url: %s)" % (newuri, origud.url))
+                    logger.debug(1, str(e))
+                    try:
+                        # setup_localpath of file:// urls may fail, we should still see 
+                        # if mirrors of the url exist
+                        adduri(newud, uris, uds, localmirrors)
+                    except UnboundLocalError:
+                        pass
+                    continue   
+                uris.append(newuri)
+                uds.append(newud)
 
-            adduri(newud, uris, uds, localmirrors)
+                adduri(newud, uris, uds, localmirrors)
 
     adduri(origud, uris, uds, mirrors)
 
@@ -953,7 +959,8 @@ def try_mirror_url(fetch, origud, ud, ld, check = False):
         # We may be obtaining a mirror tarball which needs further processing by the real fetcher
         # If that tarball is a local file:// we need to provide a symlink to it
         dldir = ld.getVar("DL_DIR", True)
-        if origud.mirrortarball and os.path.basename(ud.localpath) == os.path.basename(origud.mirrortarball) \
+        tarballs = [os.path.basename(t) for t in origud.mirrortarballs or [origud.mirrortarball] if t]
+        if os.path.basename(ud.localpath) in tarballs \
                 and os.path.basename(ud.localpath) != os.path.basename(origud.localpath):
             # Create donestamp in old format to avoid triggering a re-download
             if ud.donestamp:
@@ -1152,6 +1159,7 @@ class FetchData(object):
         self.localpath = None
         self.lockfile = None
         self.mirrortarball = None
+        self.mirrortarballs = []
         self.basename = None
         self.basepath = None
         (self.type, self.host, self.path, self.user, self.pswd, self.parm) = decodeurl(data.expand(url, d))
@@ -1543,6 +1551,9 @@ class Fetch(object):
     def download(self, urls=None):
         """
         Fetch all urls
+
+        If BB_NUMBER_FETCH_THREADS is greater than one, up to that many urls
+        are fetched at a time by download_parallel()
         """
         if not urls:
             urls = self.urls
@@ -1550,82 +1561,155 @@ class Fetch(object):
         network = self.d.getVar("BB_NO_NETWORK", True)
         premirroronly = (self.d.getVar("BB_FETCH_PREMIRRORONLY", True) == "1")
 
+        threads = int(self.d.getVar("BB_NUMBER_FETCH_THREADS", True) or 1)
+        if threads > 1 and len(urls) > 1:
+            self.download_parallel(urls, network, premirroronly, threads)
+            return
+
         for u in urls:
-            ud = self.ud[u]
-            ud.setup_localpath(self.d)
-            m = ud.method
-            localpath = ""
+            self.download_url(u, network, premirroronly)
 
-            if ud.lockfile:
-                lf = bb.utils.lockfile(ud.lockfile)
+    def download_url(self, u, network, premirroronly):
+        """
+        Fetch url u, from PREMIRRORS, upstream or MIRRORS
+        """
+        ud = self.ud[u]
+        ud.setup_localpath(self.d)
+        m = ud.method
+        localpath = ""
 
-            try:
-                self.d.setVar("BB_NO_NETWORK", network)
+        if ud.lockfile:
+            lf = bb.utils.lockfile(ud.lockfile)
+
+        try:
+            self.d.setVar("BB_NO_NETWORK", network)
  
-                if verify_donestamp(ud, self.d) and not m.need_update(ud, self.d):
-                    localpath = ud.localpath
-                elif m.try_premirror(ud, self.d):
-                    logger.debug(1, "Trying PREMIRRORS")
-                    mirrors = mirror_from_string(self.d.getVar('PREMIRRORS', True))
-                    localpath = try_mirrors(self, self.d, ud, mirrors, False)
+            if verify_donestamp(ud, self.d) and not m.need_update(ud, self.d):
+                localpath = ud.localpath
+            elif m.try_premirror(ud, self.d):
+                logger.debug(1, "Trying PREMIRRORS")
+                mirrors = mirror_from_string(self.d.getVar('PREMIRRORS', True))
+                localpath = try_mirrors(self, self.d, ud, mirrors, False)
 
-                if premirroronly:
-                    self.d.setVar("BB_NO_NETWORK", "1")
+            if premirroronly:
+                self.d.setVar("BB_NO_NETWORK", "1")
 
-                os.chdir(self.d.getVar("DL_DIR", True))
+            os.chdir(self.d.getVar("DL_DIR", True))
 
-                firsterr = None
-                verified_stamp = verify_donestamp(ud, self.d)
-                if not localpath and (not verified_stamp or m.need_update(ud, self.d)):
-                    try:
-                        if not trusted_network(self.d, ud.url):
-                            raise UntrustedUrl(ud.url)
-                        logger.debug(1, "Trying Upstream")
-                        m.download(ud, self.d)
-                        if hasattr(m, "build_mirror_data"):
-                            m.build_mirror_data(ud, self.d)
-                        localpath = ud.localpath
-                        # early checksum verify, so that if checksum mismatched,
-                        # fetcher still have chance to fetch from mirror
-                        update_stamp(ud, self.d)
-
-                    except bb.fetch2.NetworkAccess:
+            firsterr = None
+            verified_stamp = verify_donestamp(ud, self.d)
+            if not localpath and (not verified_stamp or m.need_update(ud, self.d)):
+                try:
+                    if not trusted_network(self.d, ud.url):
+                        raise UntrustedUrl(ud.url)
+                    logger.debug(1, "Trying Upstream")
+                    m.download(ud, self.d)
+                    if hasattr(m, "build_mirror_data"):
+                        m.build_mirror_data(ud, self.d)
+                    localpath = ud.localpath
+                    # early checksum verify, so that if checksum mismatched,
+                    # fetcher still have chance to fetch from mirror
+                    update_stamp(ud, self.d)
+
+                except bb.fetch2.NetworkAccess:
+                    raise
+
+                except BBFetchException as e:
+                    if isinstance(e, ChecksumError):
+                        logger.warn("Checksum failure encountered with download of %s - will attempt other sources if available" % u)
+                        logger.debug(1, str(e))
+                        if os.path.exists(ud.localpath):
+                            rename_bad_checksum(ud, e.checksum)
+                    elif isinstance(e, NoChecksumError):
                         raise
+                    else:
+                        logger.warn('Failed to fetch URL %s, attempting MIRRORS if available' % u)
+                        logger.debug(1, str(e))
+                    firsterr = e
+                    # Remove any incomplete fetch
+                    if not verified_stamp:
+                        m.clean(ud, self.d)
+                    logger.debug(1, "Trying MIRRORS")
+                    mirrors = mirror_from_string(self.d.getVar('MIRRORS', True))
+                    localpath = try_mirrors(self, self.d, ud, mirrors)
+
+            if not localpath or ((not os.path.exists(localpath)) and localpath.find("*") == -1):
+                if firsterr:
+                    logger.error(str(firsterr))
+                raise FetchError("Unable to fetch URL from any source.", u)
+
+            update_stamp(ud, self.d)
+
+        except BBFetchException as e:
+            if isinstance(e, ChecksumError):
+                logger.error("Checksum failure fetching %s" % u)
+            raise
 
-                    except BBFetchException as e:
-                        if isinstance(e, ChecksumError):
-                            logger.warn("Checksum failure encountered with download of %s - will attempt other sources if available" % u)
-                            logger.debug(1, str(e))
-                            if os.path.exists(ud.localpath):
-                                rename_bad_checksum(ud, e.checksum)
-                        elif isinstance(e, NoChecksumError):
-                            raise
-                        else:
-                            logger.warn('Failed to fetch URL %s, attempting MIRRORS if available' % u)
-                            logger.debug(1, str(e))
-                        firsterr = e
-                        # Remove any incomplete fetch
-                        if not verified_stamp:
-                            m.clean(ud, self.d)
-                        logger.debug(1, "Trying MIRRORS")
-                        mirrors = mirror_from_string(self.d.getVar('MIRRORS', True))
-                        localpath = try_mirrors(self, self.d, ud, mirrors)
-
-                if not localpath or ((not os.path.exists(localpath)) and localpath.find("*") == -1):
-                    if firsterr:
-                        logger.error(str(firsterr))
-                    raise FetchError("Unable to fetch URL from any source.", u)
-
-                update_stamp(ud, self.d)
-
-            except BBFetchException as e:
-                if isinstance(e, ChecksumError):
-                    logger.error("Checksum failure fetching %s" % u)
-                raise
-
-            finally:
-                if ud.lockfile:
-                    bb.utils.unlockfile(lf)
+        finally:
+            if ud.lockfile:
+                bb.utils.unlockfile(lf)
+
+    def download_parallel(self, urls, network, premirroronly, threads):
+        """
+        Fetch urls using up to threads forked processes, each running
+        download_url() for one url so the lockfiles, mirrors and donestamps
+        are handled as for serial downloads. After a failure no further
+        urls are started and the first failure (in urls order) is raised
+        once the running downloads have finished.
+        """
+        for u in urls:
+            self.ud[u].setup_localpath(self.d)
+
+        results = multiprocessing.Queue()
+
+        def child(u):
+            try:
+                self.download_url(u, network, premirroronly)
+                result = None
+            except Exception as e:
+                result = e
+            try:
+                result = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                result = pickle.dumps(FetchError(str(result), u), pickle.HIGHEST_PROTOCOL)
+            results.put((u, result))
+
+        pending = list(urls)
+        running = {}
+        errors = {}
+        while pending or running:
+            while pending and len(running) < threads and not errors:
+                u = pending.pop(0)
+                running[u] = multiprocessing.Process(target=child, args=(u,))
+                running[u].start()
+            if not running:
+                break
+
+            try:
+                u, result = results.get(timeout=1)
+            except Queue.Empty:
+                for u, p in running.items():
+                    # A process exiting normally has already queued its result
+                    if not p.is_alive() and p.exitcode != 0:
+                        del running[u]
+                        errors[u] = FetchError("Download process exited with code %s" % p.exitcode, u)
+                continue
+
+            if u in running:
+                running.pop(u).join()
+            try:
+                result = pickle.loads(result)
+            except Exception as e:
+                result = FetchError("Unable to fetch URL (%s)" % e, u)
+            if result is not None:
+                errors[u] = result
+
+        if premirroronly:
+            self.d.setVar("BB_NO_NETWORK", "1")
+
+        for u in urls:
+            if u in errors:
+                raise errors[u]
 
     def checkstatus(self, urls=None):
         """
@@ -49,6 +49,12 @@ Supported SRC_URI options are:
    referring to commit which is valid in tag instead of branch.
    The default is "0", set nobranch=1 if needed.
 
+Setting BB_GIT_SHALLOW = "1" makes the fetcher prefer a shallow mirror
+tarball, holding only the history of the wanted revisions down to
+BB_GIT_SHALLOW_DEPTH commits, over the full mirror tarball when fetching
+from mirrors. The full mirror tarball is used if no shallow one is found.
+Such shallow tarballs are created when BB_GENERATE_SHALLOW_TARBALLS is set.
+
 """
 
 #Copyright (C) 2005 Richard Purdie
@@ -69,6 +75,7 @@ Supported SRC_URI options are:
 import errno
 import os
 import re
+import tempfile
 import bb
 import errno
 from   bb    import data
@@ -130,6 +137,9 @@ class Git(FetchMethod):
 
         ud.write_tarballs = ((data.getVar("BB_GENERATE_MIRROR_TARBALLS", d, True) or "0") != "0") or ud.rebaseable
 
+        ud.shallow = d.getVar("BB_GIT_SHALLOW", True) == "1"
+        ud.write_shallow_tarballs = (d.getVar("BB_GENERATE_SHALLOW_TARBALLS", True) or "0") != "0"
+
         ud.setup_revisons(d)
 
         for name in ud.names:
@@ -152,6 +162,26 @@ class Git(FetchMethod):
                 gitsrcname = gitsrcname + '_' + ud.revisions[name]
         ud.mirrortarball = 'git2_%s.tar.gz' % (gitsrcname)
         ud.fullmirror = os.path.join(d.getVar("DL_DIR", True), ud.mirrortarball)
+        ud.mirrortarballs = [ud.mirrortarball]
+
+        # Shallow mirror tarballs only hold the wanted revisions, so they
+        # are always specific to those revisions and the depth
+        ud.shallowtarball = None
+        ud.fullshallow = None
+        if ud.shallow or ud.write_shallow_tarballs:
+            depth = d.getVar("BB_GIT_SHALLOW_DEPTH", True) or "1"
+            try:
+                ud.shallow_depth = int(depth)
+            except ValueError:
+                raise bb.fetch2.FetchError("Invalid depth for BB_GIT_SHALLOW_DEPTH: %s" % depth, ud.url)
+            if ud.shallow_depth < 1:
+                raise bb.fetch2.FetchError("Invalid depth for BB_GIT_SHALLOW_DEPTH: %s" % depth, ud.url)
+
+            revs = "_".join(ud.revisions[name][:7] for name in ud.names)
+            ud.shallowtarball = 'gitshallow_%s_%s-%s.tar.gz' % (gitsrcname, revs, ud.shallow_depth)
+            ud.fullshallow = os.path.join(d.getVar("DL_DIR", True), ud.shallowtarball)
+            if ud.shallow:
+                ud.mirrortarballs.insert(0, ud.shallowtarball)
         gitdir = d.getVar("GITDIR", True) or (d.getVar("DL_DIR", True) + "/git2/")
         ud.clonedir = os.path.join(gitdir, gitsrcname)
 
@@ -169,6 +199,8 @@ class Git(FetchMethod):
                 return True
         if ud.write_tarballs and not os.path.exists(ud.fullmirror):
             return True
+        if ud.write_shallow_tarballs and not os.path.exists(ud.fullshallow):
+            return True
         return False
 
     def try_premirror(self, ud, d):
@@ -183,6 +215,20 @@ class Git(FetchMethod):
     def download(self, ud, d):
         """Fetch url"""
 
+        # If the checkout doesn't exist and a shallow mirror tarball does,
+        # prefer it, as long as it really has the revisions we need
+        if ud.shallow and not os.path.exists(ud.clonedir) and os.path.exists(ud.fullshallow):
+            bb.utils.mkdirhier(ud.clonedir)
+            os.chdir(ud.clonedir)
+            runfetchcmd("tar -xzf %s" % (ud.fullshallow), d)
+            for name in ud.names:
+                if not self._contains_ref(ud, d, name):
+                    logger.warn("Shallow mirror tarball %s doesn't contain revision %s, ignoring it" % (ud.fullshallow, ud.revisions[name]))
+                    bb.utils.remove(ud.clonedir, True)
+                    bb.utils.remove(ud.fullshallow)
+                    bb.utils.remove(ud.fullshallow + ".done")
+                    break
+
         # If the checkout doesn't exist and the mirror tarball does, extract it
         if not os.path.exists(ud.clonedir) and os.path.exists(ud.fullmirror):
             bb.utils.mkdirhier(ud.clonedir)
@@ -225,6 +271,15 @@ class Git(FetchMethod):
             except OSError as exc:
                 if exc.errno != errno.ENOENT:
                     raise
+
+        # A full mirror tarball can't be made from a shallow checkout, so
+        # fetch the rest of the history first
+        if ud.write_tarballs and os.path.exists(os.path.join(ud.clonedir, "shallow")):
+            fetch_cmd = "%s fetch -f --unshallow %s refs/*:refs/*" % (ud.basecmd, repourl)
+            if ud.proto.lower() != 'file':
+                bb.fetch2.check_network_access(d, fetch_cmd, ud.url)
+            runfetchcmd(fetch_cmd, d)
+
         os.chdir(ud.clonedir)
         for name in ud.names:
             if not self._contains_ref(ud, d, name):
@@ -242,6 +297,32 @@ class Git(FetchMethod):
             runfetchcmd("tar -czf %s %s" % (ud.fullmirror, os.path.join(".") ), d)
             runfetchcmd("touch %s.done" % (ud.fullmirror), d)
 
+        # Generate a shallow mirror tarball holding only the wanted revisions
+        if ud.write_shallow_tarballs and not os.path.exists(ud.fullshallow):
+            if os.path.islink(ud.fullshallow):
+                os.unlink(ud.fullshallow)
+
+            logger.info("Creating shallow tarball of git repository")
+            refs = []
+            branches = set()
+            for name in ud.names:
+                branch = ud.branches[name]
+                if branch in branches:
+                    branch = "%s-%s" % (branch, name)
+                branches.add(branch)
+                refs.append("%s:refs/heads/%s" % (ud.revisions[name], branch))
+
+            shallowdir = tempfile.mkdtemp(dir=os.path.dirname(ud.fullshallow))
+            try:
+                os.chdir(shallowdir)
+                runfetchcmd("%s init --bare" % ud.basecmd, d)
+                runfetchcmd("%s -c uploadpack.allowReachableSHA1InWant=true fetch --depth=%s file://%s %s" %
+                            (ud.basecmd, ud.shallow_depth, ud.clonedir, " ".join(refs)), d)
+                runfetchcmd("tar -czf %s %s" % (ud.fullshallow, os.path.join(".") ), d)
+                runfetchcmd("touch %s.done" % (ud.fullshallow), d)
+            finally:
+                bb.utils.prunedir(shallowdir)
+
     def unpack(self, ud, destdir, d):
         """ unpack the downloaded src to destdir"""
 
@@ -287,6 +368,9 @@ class Git(FetchMethod):
         bb.utils.remove(ud.localpath, True)
         bb.utils.remove(ud.fullmirror)
         bb.utils.remove(ud.fullmirror + ".done")
+        if ud.fullshallow:
+            bb.utils.remove(ud.fullshallow)
+            bb.utils.remove(ud.fullshallow + ".done")
 
     def supports_srcrev(self):
         return True
@@ -0,0 +1,131 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+"""
+BitBake worker message framing
+
+Messages passed between the runqueue, bitbake-worker and the task processes
+it forks are sent as length prefixed frames: a one byte message type and a
+four byte payload length in network byte order, followed by the payload
+(usually a binary pickle).
+"""
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import errno
+import os
+import struct
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+HEADER = struct.Struct("!BI")
+
+MESSAGES = ("cookerconfig", "workerdata", "runtask", "finishnow", "ping", "quit", "event", "exitcode")
+_codes = dict((name, code) for code, name in enumerate(MESSAGES))
+
+def encode(msgtype, payload = ""):
+    """
+    Return a frame of type msgtype holding payload
+    """
+    return HEADER.pack(_codes[msgtype], len(payload)) + payload
+
+def encode_pickle(msgtype, obj):
+    """
+    Return a frame of type msgtype holding a pickle of obj
+    """
+    return encode(msgtype, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+class FrameReader(object):
+    """
+    Accumulates data read from a (non-blocking) file descriptor and splits it
+    into frames. Data is appended to a bytearray and consumed frames are only
+    removed from its front once per read() so buffering stays linear in the
+    amount of data received.
+    """
+    def __init__(self, fd, readsize = 102400):
+        self.fd = fd
+        self.readsize = readsize
+        self.buffer = bytearray()
+
+    def fill(self):
+        """
+        Read the data currently available, returning the number of bytes
+        read (0 at end of file)
+        """
+        try:
+            data = os.read(self.fd, self.readsize)
+        except (OSError, IOError) as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return None
+        self.buffer.extend(data)
+        return len(data)
+
+    def frames(self):
+        """
+        Return a list of the (msgtype, payload) frames complete in the buffer
+        """
+        frames = []
+        buf = self.buffer
+        offset = 0
+        available = len(buf)
+        while available - offset >= HEADER.size:
+            code, length = HEADER.unpack_from(buf, offset)
+            end = offset + HEADER.size + length
+            if end > available:
+                break
+            frames.append((MESSAGES[code], str(buf[offset + HEADER.size:end])))
+            offset = end
+        if offset:
+            del buf[:offset]
+        return frames
+
+    def __len__(self):
+        return len(self.buffer)
+
+class FrameWriter(object):
+    """
+    Buffers frames for a non-blocking file descriptor and writes out as much
+    as the descriptor accepts on each flush()
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, frame):
+        self.buffer.extend(frame)
+
+    def flush(self):
+        if self.offset >= len(self.buffer):
+            return
+        try:
+            written = os.write(self.fd, memoryview(self.buffer)[self.offset:])
+        except (IOError, OSError) as e:
+            if e.errno != errno.EAGAIN and e.errno != errno.EPIPE:
+                raise
+            return
+        self.offset = self.offset + written
+        if self.offset >= len(self.buffer):
+            self.buffer = bytearray()
+            self.offset = 0
+        elif self.offset > len(self.buffer) // 2:
+            # Compact once the written part dominates the buffer
+            del self.buffer[:self.offset]
+            self.offset = 0
+
+    def __len__(self):
+        return len(self.buffer) - self.offset
@@ -27,10 +27,16 @@
 
 from __future__ import absolute_import
 import re, bb, os
+import hashlib
 import logging
 import bb.build, bb.utils
 from bb import data
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from . import ConfHandler
 from .. import resolve_file, ast, logger, ParseError
 from .ConfHandler import include, init
@@ -54,6 +60,11 @@ __classname__ = ""
 
 cached_statements = {}
 
+# Directory holding pickled statement lists of parsed files, see
+# init_statement_cache()
+statement_cache_dir = None
+STATEMENT_CACHE_VERSION = "1"
+
 def supports(fn, d):
     """Return True if fn has a supported extension"""
     return os.path.splitext(fn)[-1] in [".bb", ".bbclass", ".inc"]
@@ -81,26 +92,85 @@ def inherit(files, fn, lineno, d):
             include(fn, file, lineno, d, "inherit")
             __inherit_cache = d.getVar('__inherit_cache', False) or []
 
+def init_statement_cache(d):
+    """
+    Store the statement lists of parsed files in the bb_statements
+    directory of PERSISTENT_DIR (or CACHE) so that later runs and other
+    parser processes can load them rather than parsing the files again
+    """
+    global statement_cache_dir
+
+    cachedir = d.getVar("PERSISTENT_DIR", True) or d.getVar("CACHE", True)
+    if not cachedir:
+        statement_cache_dir = None
+        return
+    statement_cache_dir = os.path.join(cachedir, "bb_statements")
+    bb.utils.mkdirhier(statement_cache_dir)
+
+def statement_cache_key(filename, absolute_filename, base_name):
+    # The statements record the name the file was parsed under
+    return "\0".join([STATEMENT_CACHE_VERSION, bb.__version__, filename, absolute_filename, base_name])
+
+def load_statements(key, st):
+    """
+    Return the cached statement list for key if it was stored for a file
+    of the same modification time and size, else None
+    """
+    cachefile = os.path.join(statement_cache_dir, hashlib.md5(key).hexdigest())
+    try:
+        with open(cachefile, "rb") as f:
+            cachedkey, mtime, size, statements = pickle.load(f)
+    except Exception:
+        return None
+    if (cachedkey, mtime, size) != (key, st.st_mtime, st.st_size):
+        return None
+    return statements
+
+def save_statements(absolute_filename, key, st, statements):
+    cachefile = os.path.join(statement_cache_dir, hashlib.md5(key).hexdigest())
+    tmpfile = "%s.%s" % (cachefile, os.getpid())
+    try:
+        with open(tmpfile, "wb") as f:
+            pickle.dump((key, st.st_mtime, st.st_size, statements), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, cachefile)
+    except (EnvironmentError, pickle.PicklingError) as exc:
+        logger.debug(1, "Unable to cache the statements of %s: %s", absolute_filename, exc)
+        bb.utils.remove(tmpfile)
+
 def get_statements(filename, absolute_filename, base_name):
     global cached_statements
 
     try:
         return cached_statements[absolute_filename]
     except KeyError:
-        file = open(absolute_filename, 'r')
-        statements = ast.StatementGroup()
-
-        lineno = 0
-        while True:
-            lineno = lineno + 1
-            s = file.readline()
-            if not s: break
-            s = s.rstrip()
-            feeder(lineno, s, filename, base_name, statements)
-        file.close()
-        if __inpython__:
-            # add a blank line to close out any python definition
-            feeder(lineno, "", filename, base_name, statements, eof=True)
+        statements = None
+        if statement_cache_dir:
+            # Stat before reading so a change during the read invalidates
+            # the cached copy
+            key = statement_cache_key(filename, absolute_filename, base_name)
+            st = os.stat(absolute_filename)
+            statements = load_statements(key, st)
+
+        if statements is None:
+            file = open(absolute_filename, 'r')
+            statements = ast.StatementGroup()
+
+            lineno = 0
+            while True:
+                lineno = lineno + 1
+                s = file.readline()
+                if not s: break
+                s = s.rstrip()
+                feeder(lineno, s, filename, base_name, statements)
+            file.close()
+            if __inpython__:
+                # add a blank line to close out any python definition
+                feeder(lineno, "", filename, base_name, statements, eof=True)
+
+            # Files with unterminated functions or lines fail in handle(),
+            # which relies on the parser state left behind by the feeder
+            if statement_cache_dir and not __infunc__ and not __residue__:
+                save_statements(absolute_filename, key, st, statements)
 
         if filename.endswith(".bbclass") or filename.endswith(".inc"):
             cached_statements[absolute_filename] = statements
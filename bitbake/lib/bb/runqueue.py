@@ -29,12 +29,16 @@ import signal
 import stat
 import fcntl
 import errno
+import heapq
 import logging
 import re
 import bb
 from bb import msg, data, event
 from bb import monitordisk
+from bb import admission
+from bb import framing
 import subprocess
+import time
 
 try:
     import cPickle as pickle
@@ -106,7 +110,12 @@ class RunQueueScheduler(object):
         self.prio_map = []
         self.prio_map.extend(range(self.numTasks))
 
+        # Tasks which became buildable since the last call to
+        # next_buildable_task(). These are merged into the ready heap lazily
+        # since subclasses only set up prio_map after this constructor runs.
         self.buildable = []
+        # Heap of (priority, taskid) for buildable tasks, lowest priority first
+        self.ready = []
         self.stamps = {}
         for taskid in xrange(self.numTasks):
             fn = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[taskid]]
@@ -119,32 +128,34 @@ class RunQueueScheduler(object):
 
     def next_buildable_task(self):
         """
-        Return the id of the first task we find that is buildable
+        Return the id of the highest priority task that is buildable, whose
+        stamp isn't already in use by a running task and which the admission
+        controller allows to start
         """
-        self.buildable = [x for x in self.buildable if not self.rq.runq_running[x] == 1]
-        if not self.buildable:
-            return None
-        if len(self.buildable) == 1:
-            taskid = self.buildable[0]
-            stamp = self.stamps[taskid]
-            if stamp not in self.rq.build_stamps.itervalues():
-                return taskid
-
         if not self.rev_prio_map:
-            self.rev_prio_map = range(self.numTasks)
-            for taskid in xrange(self.numTasks):
-                self.rev_prio_map[self.prio_map[taskid]] = taskid
+            self.rev_prio_map = [0] * self.numTasks
+            for prio, taskid in enumerate(self.prio_map):
+                self.rev_prio_map[taskid] = prio
 
-        best = None
-        bestprio = None
         for taskid in self.buildable:
-            prio = self.rev_prio_map[taskid]
-            if bestprio is None or bestprio > prio:
-                stamp = self.stamps[taskid]
-                if stamp in self.rq.build_stamps.itervalues():
-                    continue
-                bestprio = prio
-                best = taskid
+            heapq.heappush(self.ready, (self.rev_prio_map[taskid], taskid))
+        self.buildable = []
+
+        best = None
+        blocked = []
+        while self.ready:
+            prio, taskid = self.ready[0]
+            if self.rq.runq_running[taskid] == 1:
+                heapq.heappop(self.ready)
+                continue
+            if self.stamps[taskid] in self.rq.build_stamps2 or not self.rq.admission.can_start(taskid):
+                blocked.append(heapq.heappop(self.ready))
+                continue
+            best = taskid
+            break
+
+        for entry in blocked:
+            heapq.heappush(self.ready, entry)
 
         return best
 
@@ -152,7 +163,7 @@ class RunQueueScheduler(object):
         """
         Return the id of the task we should build next
         """
-        if self.rq.stats.active < self.rq.number_tasks:
+        if self.rq.stats.active < self.rq.admission.max_active():
             return self.next_buildable_task()
 
     def newbuilable(self, task):
@@ -171,15 +182,10 @@ class RunQueueSchedulerSpeed(RunQueueScheduler):
         """
         RunQueueScheduler.__init__(self, runqueue, rqdata)
 
-        sortweight = sorted(copy.deepcopy(self.rqdata.runq_weight))
-        copyweight = copy.deepcopy(self.rqdata.runq_weight)
-        self.prio_map = []
-
-        for weight in sortweight:
-            idx = copyweight.index(weight)
-            self.prio_map.append(idx)
-            copyweight[idx] = -1
-
+        # Heaviest tasks first. The sort is stable so, once reversed, equally
+        # weighted tasks are ordered by descending task id as they always were
+        weights = self.rqdata.runq_weight
+        self.prio_map = sorted(xrange(self.numTasks), key=weights.__getitem__)
         self.prio_map.reverse()
 
 class RunQueueSchedulerCompletion(RunQueueSchedulerSpeed):
@@ -198,21 +204,142 @@ class RunQueueSchedulerCompletion(RunQueueSchedulerSpeed):
         #FIXME - whilst this groups all fnids together it does not reorder the
         #fnid groups optimally.
 
-        basemap = copy.deepcopy(self.prio_map)
-        self.prio_map = []
-        while (len(basemap) > 0):
-            entry = basemap.pop(0)
-            self.prio_map.append(entry)
+        fnid_tasks = {}
+        fnid_order = []
+        for entry in self.prio_map:
             fnid = self.rqdata.runq_fnid[entry]
-            todel = []
-            for entry in basemap:
-                entry_fnid = self.rqdata.runq_fnid[entry]
-                if entry_fnid == fnid:
-                    todel.append(basemap.index(entry))
-                    self.prio_map.append(entry)
-            todel.reverse()
-            for idx in todel:
-                del basemap[idx]
+            if fnid not in fnid_tasks:
+                fnid_tasks[fnid] = []
+                fnid_order.append(fnid)
+            fnid_tasks[fnid].append(entry)
+
+        self.prio_map = []
+        for fnid in fnid_order:
+            self.prio_map.extend(fnid_tasks[fnid])
+
+class RunQueueSchedulerCritical(RunQueueSchedulerSpeed):
+    """
+    A scheduler which runs the tasks heading the longest remaining chain of
+    work first. Task durations come from the buildstats (as written by OE's
+    buildstats class under BUILDSTATS_BASE) of previous builds. Tasks with
+    no recorded duration are estimated from the same task in other recipes
+    and ties, including the case where there is no history at all, are
+    broken using the task weight ordering of the speed scheduler.
+    """
+    name = "critical"
+
+    # Number of previous builds to read durations from, newest first
+    history = 5
+
+    def __init__(self, runqueue, rqdata):
+        RunQueueSchedulerSpeed.__init__(self, runqueue, rqdata)
+
+        pathlen = self.calculate_critical_paths(self.estimate_durations())
+
+        speedprio = [0] * self.numTasks
+        for prio, taskid in enumerate(self.prio_map):
+            speedprio[taskid] = prio
+        self.prio_map = sorted(xrange(self.numTasks), key=lambda taskid: (-pathlen[taskid], speedprio[taskid]))
+
+    def get_task_pf(self, taskid):
+        fn = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[taskid]]
+        pn = self.rqdata.dataCache.pkg_fn[fn]
+        pe, pv, pr = self.rqdata.dataCache.pkg_pepvpr[fn]
+        if pe and pe != "0":
+            return "%s-%s_%s-%s" % (pn, pe, pv, pr)
+        return "%s-%s-%s" % (pn, pv, pr)
+
+    def load_buildstats(self, pfs):
+        """
+        Return a dict of (PF, taskname) -> elapsed seconds for the PFs given,
+        read from the most recent buildstats directories with newer builds
+        taking precedence
+        """
+        durations = {}
+        bsbase = self.rq.cfgData.getVar("BUILDSTATS_BASE", True)
+        if not bsbase or not os.path.isdir(bsbase):
+            return durations
+
+        current = self.rq.cfgData.getVar("BUILDNAME", True)
+        builds = []
+        for build in os.listdir(bsbase):
+            path = os.path.join(bsbase, build)
+            if build != current and os.path.isdir(path):
+                builds.append((os.path.getmtime(path), path))
+        builds.sort(reverse=True)
+
+        elapsed_re = re.compile(r"Elapsed time: ([0-9.]+) seconds")
+        for _, path in builds[:self.history]:
+            for pf in os.listdir(path):
+                if pf not in pfs:
+                    continue
+                pfdir = os.path.join(path, pf)
+                if not os.path.isdir(pfdir):
+                    continue
+                for taskname in os.listdir(pfdir):
+                    if (pf, taskname) in durations:
+                        continue
+                    try:
+                        with open(os.path.join(pfdir, taskname), "r") as f:
+                            m = elapsed_re.search(f.read())
+                    except IOError:
+                        continue
+                    if m:
+                        durations[(pf, taskname)] = float(m.group(1))
+
+        logger.debug(1, "Loaded %s task durations from %s", len(durations), bsbase)
+        return durations
+
+    def estimate_durations(self):
+        """
+        Return the expected duration of each task. Tasks without history use
+        the mean duration of the same task in recipes which do have history.
+        """
+        pfs = [self.get_task_pf(taskid) for taskid in xrange(self.numTasks)]
+        history = self.load_buildstats(set(pfs))
+
+        cost = [None] * self.numTasks
+        totals = {}
+        for taskid in xrange(self.numTasks):
+            taskname = self.rqdata.runq_task[taskid]
+            duration = history.get((pfs[taskid], taskname))
+            if duration is not None:
+                cost[taskid] = duration
+                total, count = totals.get(taskname, (0.0, 0))
+                totals[taskname] = (total + duration, count + 1)
+
+        for taskid in xrange(self.numTasks):
+            if cost[taskid] is None:
+                total, count = totals.get(self.rqdata.runq_task[taskid], (0.0, 0))
+                if count:
+                    cost[taskid] = total / count
+                else:
+                    cost[taskid] = 0.0
+        return cost
+
+    def calculate_critical_paths(self, cost):
+        """
+        Return, for each task, the length of the longest chain of work from
+        the start of that task to the end of the build
+        """
+        revdeps = self.rqdata.runq_revdeps
+        pathlen = [0.0] * self.numTasks
+        revdeps_left = [len(revdeps[taskid]) for taskid in xrange(self.numTasks)]
+        todo = [taskid for taskid in xrange(self.numTasks) if not revdeps_left[taskid]]
+
+        while todo:
+            taskid = todo.pop()
+            longest = 0.0
+            for revdep in revdeps[taskid]:
+                if pathlen[revdep] > longest:
+                    longest = pathlen[revdep]
+            pathlen[taskid] = cost[taskid] + longest
+            for dep in self.rqdata.runq_depends[taskid]:
+                revdeps_left[dep] = revdeps_left[dep] - 1
+                if revdeps_left[dep] == 0:
+                    todo.append(dep)
+
+        return pathlen
 
 class RunQueueData:
     """
@@ -220,6 +347,7 @@ class RunQueueData:
     """
     def __init__(self, rq, cooker, cfgData, dataCache, taskData, targets):
         self.cooker = cooker
+        self.cfgData = cfgData
         self.dataCache = dataCache
         self.taskData = taskData
         self.targets = targets
@@ -884,18 +1012,31 @@ class RunQueueData:
         if hasattr(bb.parse.siggen, "tasks_resolved"):
             bb.parse.siggen.tasks_resolved(virtmap, virtpnmap, self.dataCache)
 
-        # Iterate over the task list and call into the siggen code
-        dealtwith = set()
-        todeal = set(range(len(self.runq_fnid)))
-        while len(todeal) > 0:
-            for task in todeal.copy():
-                if len(self.runq_depends[task] - dealtwith) == 0:
-                    dealtwith.add(task)
-                    todeal.remove(task)
-                    procdep = []
-                    for dep in self.runq_depends[task]:
-                        procdep.append(self.taskData.fn_index[self.runq_fnid[dep]] + "." + self.runq_task[dep])
-                    self.runq_hash[task] = bb.parse.siggen.get_taskhash(self.taskData.fn_index[self.runq_fnid[task]], self.runq_task[task], procdep, self.dataCache)
+        # Iterate over the task list in dependency order and call into the
+        # siggen code. The siggen object outlives this runqueue, report the
+        # time spent on this set of hashes only.
+        if hasattr(bb.parse.siggen, "hash_timings"):
+            for k in bb.parse.siggen.hash_timings:
+                bb.parse.siggen.hash_timings[k] = 0.0
+        start = time.time()
+        deps_left = [len(self.runq_depends[task]) for task in xrange(len(self.runq_fnid))]
+        ready = [task for task in xrange(len(self.runq_fnid)) if not deps_left[task]]
+        while ready:
+            task = ready.pop()
+            procdep = []
+            for dep in self.runq_depends[task]:
+                procdep.append(self.taskData.fn_index[self.runq_fnid[dep]] + "." + self.runq_task[dep])
+            self.runq_hash[task] = bb.parse.siggen.get_taskhash(self.taskData.fn_index[self.runq_fnid[task]], self.runq_task[task], procdep, self.dataCache)
+            for revdep in self.runq_revdeps[task]:
+                deps_left[revdep] = deps_left[revdep] - 1
+                if deps_left[revdep] == 0:
+                    ready.append(revdep)
+
+        timings = dict(getattr(bb.parse.siggen, "hash_timings", {}))
+        timings["total"] = time.time() - start
+        logger.debug(1, "Task hash calculation took %.2fs (%s)", timings["total"],
+                     ", ".join("%s %.2fs" % (k, v) for k, v in sorted(timings.items()) if k != "total"))
+        bb.event.fire(bb.event.TaskHashesCalculated(len(self.runq_fnid), timings), self.cfgData)
 
         bb.parse.siggen.writeout_file_checksum_cache()
         return len(self.runq_fnid)
@@ -924,6 +1065,66 @@ class RunQueueData:
                            self.rqdata.runq_depends[task],
                            self.rqdata.runq_revdeps[task])
 
+class RunQueueStampIndex(object):
+    """
+    Cache of task stamp paths and stamp modification times.
+
+    Each stamp directory is listed once and only the stamps found in it are
+    stat()ed, which avoids a lookup per missing stamp on slow (e.g. NFS)
+    filesystems. A directory's entries are kept until invalidate() is called
+    for a task stamping into it.
+    """
+    def __init__(self, rqdata):
+        self.rqdata = rqdata
+        self.paths = {}
+        self.dirs = {}
+
+    def stampfile(self, task, taskname = None):
+        """
+        Return the stamp path for task (with an optional alternative
+        taskname such as the _setscene variant)
+        """
+        if taskname is None:
+            taskname = self.rqdata.runq_task[task]
+        key = (task, taskname)
+        if key not in self.paths:
+            fn = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[task]]
+            self.paths[key] = bb.build.stampfile(taskname, self.rqdata.dataCache, fn)
+        return self.paths[key]
+
+    def mtime(self, stampfile):
+        """
+        Return the modification time of stampfile or None if it doesn't exist
+        """
+        if not stampfile:
+            return None
+        dirname, name = os.path.split(stampfile)
+        if dirname not in self.dirs:
+            try:
+                entries = os.listdir(dirname)
+            except OSError:
+                entries = []
+            self.dirs[dirname] = dict.fromkeys(entries, False)
+        mtimes = self.dirs[dirname]
+        mtime = mtimes.get(name)
+        if mtime is False:
+            try:
+                mtime = os.stat(stampfile)[stat.ST_MTIME]
+            except OSError:
+                mtime = None
+            mtimes[name] = mtime
+        return mtime
+
+    def invalidate(self, task):
+        """
+        Forget what is known about the stamp directory of task, e.g. after
+        the task has run and may have written or removed stamps
+        """
+        for taskname in (self.rqdata.runq_task[task], self.rqdata.runq_task[task] + "_setscene"):
+            stampfile = self.stampfile(task, taskname)
+            if stampfile:
+                self.dirs.pop(os.path.dirname(stampfile), None)
+
 class RunQueue:
     def __init__(self, cooker, cfgData, dataCache, taskData, targets):
 
@@ -938,6 +1139,8 @@ class RunQueue:
 
         self.state = runQueuePrepare
 
+        self.stampindex = RunQueueStampIndex(self.rqdata)
+
         # For disk space monitor
         self.dm = monitordisk.diskMonitor(cfgData)
 
@@ -982,8 +1185,8 @@ class RunQueue:
             "time" : self.cfgData.getVar("TIME", True),
         }
 
-        worker.stdin.write("<cookerconfig>" + pickle.dumps(self.cooker.configuration) + "</cookerconfig>")
-        worker.stdin.write("<workerdata>" + pickle.dumps(workerdata) + "</workerdata>")
+        worker.stdin.write(framing.encode_pickle("cookerconfig", self.cooker.configuration))
+        worker.stdin.write(framing.encode_pickle("workerdata", workerdata))
         worker.stdin.flush()
 
         return worker, workerpipe
@@ -993,7 +1196,7 @@ class RunQueue:
             return
         logger.debug(1, "Teardown for bitbake-worker")
         try:
-           worker.stdin.write("<quit></quit>")
+           worker.stdin.write(framing.encode("quit"))
            worker.stdin.flush()
         except IOError:
            pass
@@ -1037,14 +1240,6 @@ class RunQueue:
         return fds
 
     def check_stamp_task(self, task, taskname = None, recurse = False, cache = None):
-        def get_timestamp(f):
-            try:
-                if not os.access(f, os.F_OK):
-                    return None
-                return os.stat(f)[stat.ST_MTIME]
-            except:
-                return None
-
         if self.stamppolicy == "perfile":
             fulldeptree = False
         else:
@@ -1057,10 +1252,11 @@ class RunQueue:
         if taskname is None:
             taskname = self.rqdata.runq_task[task]
 
-        stampfile = bb.build.stampfile(taskname, self.rqdata.dataCache, fn)
+        stampfile = self.stampindex.stampfile(task, taskname)
+        t1 = self.stampindex.mtime(stampfile)
 
         # If the stamp is missing, it's not current
-        if not os.access(stampfile, os.F_OK):
+        if t1 is None:
             logger.debug(2, "Stampfile %s not available", stampfile)
             return False
         # If it's a 'nostamp' task, it's not current
@@ -1076,15 +1272,14 @@ class RunQueue:
             cache = {}
 
         iscurrent = True
-        t1 = get_timestamp(stampfile)
         for dep in self.rqdata.runq_depends[task]:
             if iscurrent:
                 fn2 = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[dep]]
                 taskname2 = self.rqdata.runq_task[dep]
-                stampfile2 = bb.build.stampfile(taskname2, self.rqdata.dataCache, fn2)
-                stampfile3 = bb.build.stampfile(taskname2 + "_setscene", self.rqdata.dataCache, fn2)
-                t2 = get_timestamp(stampfile2)
-                t3 = get_timestamp(stampfile3)
+                stampfile2 = self.stampindex.stampfile(dep)
+                stampfile3 = self.stampindex.stampfile(dep, taskname2 + "_setscene")
+                t2 = self.stampindex.mtime(stampfile2)
+                t3 = self.stampindex.mtime(stampfile3)
                 if t3 and t3 > t2:
                    continue
                 if fn == fn2 or (fulldeptree and fn2 not in stampwhitelist):
@@ -1365,7 +1560,7 @@ class RunQueueExecute:
         self.runq_complete = []
 
         self.build_stamps = {}
-        self.build_stamps2 = []
+        self.build_stamps2 = set()
         self.failed_fnids = []
 
         self.stampcache = {}
@@ -1381,7 +1576,7 @@ class RunQueueExecute:
 
         # self.build_stamps[pid] may not exist when use shared work directory.
         if task in self.build_stamps:
-            self.build_stamps2.remove(self.build_stamps[task])
+            self.build_stamps2.discard(self.build_stamps[task])
             del self.build_stamps[task]
 
         if status != 0:
@@ -1396,7 +1591,7 @@ class RunQueueExecute:
             if not worker:
                 continue
             try:
-                worker.stdin.write("<finishnow></finishnow>")
+                worker.stdin.write(framing.encode("finishnow"))
                 worker.stdin.flush()
             except IOError:
                 # worker must have died?
@@ -1520,6 +1715,7 @@ class RunQueueExecuteTasks(RunQueueExecute):
             fn = self.rqdata.taskData.fn_index[self.rqdata.runq_fnid[task]]
             taskname = self.rqdata.runq_task[task] + '_setscene'
             bb.build.del_stamp(taskname, self.rqdata.dataCache, fn)
+            self.rq.stampindex.invalidate(task)
             self.rq.scenequeue_covered.remove(task)
 
         toremove = covered_remove
@@ -1542,6 +1738,8 @@ class RunQueueExecuteTasks(RunQueueExecute):
 
         event.fire(bb.event.StampUpdate(self.rqdata.target_pairs, self.rqdata.dataCache.stamp), self.cfgData)
 
+        self.admission = admission.TaskAdmission(self, self.cfgData)
+
         schedulers = self.get_schedulers()
         for scheduler in schedulers:
             if self.scheduler == scheduler.name:
@@ -1574,6 +1772,11 @@ class RunQueueExecuteTasks(RunQueueExecute):
                     schedulers.add(getattr(module, name))
         return schedulers
 
+    def runqueue_process_waitpid(self, task, status):
+        self.rq.stampindex.invalidate(task)
+        self.admission.task_finished(task)
+        return RunQueueExecute.runqueue_process_waitpid(self, task, status)
+
     def setbuildable(self, task):
         self.runq_buildable[task] = 1
         self.sched.newbuilable(task)
@@ -1663,6 +1866,7 @@ class RunQueueExecuteTasks(RunQueueExecute):
                 self.stats.taskActive()
                 if not self.cooker.configuration.dry_run:
                     bb.build.make_stamp(taskname, self.rqdata.dataCache, fn)
+                    self.rq.stampindex.invalidate(task)
                 self.task_complete(task)
                 return True
             else:
@@ -1680,17 +1884,18 @@ class RunQueueExecuteTasks(RunQueueExecute):
                         logger.critical("Failed to spawn fakeroot worker to run %s:%s: %s" % (fn, taskname, str(exc)))
                         self.rq.state = runQueueFailed
                         return True
-                self.rq.fakeworker.stdin.write("<runtask>" + pickle.dumps((fn, task, taskname, False, self.cooker.collection.get_file_appends(fn), taskdepdata)) + "</runtask>")
+                self.rq.fakeworker.stdin.write(framing.encode_pickle("runtask", (fn, task, taskname, False, self.cooker.collection.get_file_appends(fn), taskdepdata)))
                 self.rq.fakeworker.stdin.flush()
             else:
-                self.rq.worker.stdin.write("<runtask>" + pickle.dumps((fn, task, taskname, False, self.cooker.collection.get_file_appends(fn), taskdepdata)) + "</runtask>")
+                self.rq.worker.stdin.write(framing.encode_pickle("runtask", (fn, task, taskname, False, self.cooker.collection.get_file_appends(fn), taskdepdata)))
                 self.rq.worker.stdin.flush()
 
             self.build_stamps[task] = bb.build.stampfile(taskname, self.rqdata.dataCache, fn)
-            self.build_stamps2.append(self.build_stamps[task]) 
+            self.build_stamps2.add(self.build_stamps[task])
+            self.admission.task_started(task)
             self.runq_running[task] = 1
             self.stats.taskActive()
-            if self.stats.active < self.number_tasks:
+            if self.stats.active < self.admission.max_active():
                 return True
 
         if self.stats.active > 0:
@@ -1916,6 +2121,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
                     noexec.append(task)
                     self.task_skip(task)
                     bb.build.make_stamp(taskname + "_setscene", self.rqdata.dataCache, fn)
+                    self.rq.stampindex.invalidate(realtask)
                     continue
 
                 if self.rq.check_stamp_task(realtask, taskname + "_setscene", cache=self.stampcache):
@@ -2072,10 +2278,10 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
             if 'fakeroot' in taskdep and taskname in taskdep['fakeroot']:
                 if not self.rq.fakeworker:
                     self.rq.start_fakeworker(self)
-                self.rq.fakeworker.stdin.write("<runtask>" + pickle.dumps((fn, realtask, taskname, True, self.cooker.collection.get_file_appends(fn), None)) + "</runtask>")
+                self.rq.fakeworker.stdin.write(framing.encode_pickle("runtask", (fn, realtask, taskname, True, self.cooker.collection.get_file_appends(fn), None)))
                 self.rq.fakeworker.stdin.flush()
             else:
-                self.rq.worker.stdin.write("<runtask>" + pickle.dumps((fn, realtask, taskname, True, self.cooker.collection.get_file_appends(fn), None)) + "</runtask>")
+                self.rq.worker.stdin.write(framing.encode_pickle("runtask", (fn, realtask, taskname, True, self.cooker.collection.get_file_appends(fn), None)))
                 self.rq.worker.stdin.flush()
 
             self.runq_running[task] = 1
@@ -2109,6 +2315,7 @@ class RunQueueExecuteScenequeue(RunQueueExecute):
         return True
 
     def runqueue_process_waitpid(self, task, status):
+        self.rq.stampindex.invalidate(task)
         task = self.rq.rqdata.runq_setscene.index(task)
 
         RunQueueExecute.runqueue_process_waitpid(self, task, status)
@@ -2223,7 +2430,7 @@ class runQueuePipe():
         if pipeout:
             pipeout.close()
         bb.utils.nonblockingfd(self.input)
-        self.queue = ""
+        self.queue = framing.FrameReader(self.input.fileno())
         self.d = d
         self.rq = rq
         self.rqexec = rqexec
@@ -2245,41 +2452,22 @@ class runQueuePipe():
                 bb.error("%s process (%s) exited unexpectedly (%s), shutting down..." % (name, w.pid, str(w.returncode)))
                 self.rq.finish_runqueue(True)
 
-        start = len(self.queue)
-        try:
-            self.queue = self.queue + self.input.read(102400)
-        except (OSError, IOError) as e:
-            if e.errno != errno.EAGAIN:
-                raise
-        end = len(self.queue)
-        found = True
-        while found and len(self.queue):
-            found = False
-            index = self.queue.find("</event>")
-            while index != -1 and self.queue.startswith("<event>"):
-                try:
-                    event = pickle.loads(self.queue[7:index])
-                except ValueError as e:
-                    bb.msg.fatal("RunQueue", "failed load pickle '%s': '%s'" % (e, self.queue[7:index]))
-                bb.event.fire_from_worker(event, self.d)
-                found = True
-                self.queue = self.queue[index+8:]
-                index = self.queue.find("</event>")
-            index = self.queue.find("</exitcode>")
-            while index != -1 and self.queue.startswith("<exitcode>"):
-                try:
-                    task, status = pickle.loads(self.queue[10:index])
-                except ValueError as e:
-                    bb.msg.fatal("RunQueue", "failed load pickle '%s': '%s'" % (e, self.queue[10:index]))
+        read = self.queue.fill()
+        for msgtype, payload in self.queue.frames():
+            try:
+                msg = pickle.loads(payload)
+            except ValueError as e:
+                bb.msg.fatal("RunQueue", "failed load pickle '%s': '%s'" % (e, payload))
+            if msgtype == "event":
+                bb.event.fire_from_worker(msg, self.d)
+            elif msgtype == "exitcode":
+                task, status = msg
                 self.rqexec.runqueue_process_waitpid(task, status)
-                found = True
-                self.queue = self.queue[index+11:]
-                index = self.queue.find("</exitcode>")
-        return (end > start)
+        return bool(read)
 
     def close(self):
         while self.read():
             continue
         if len(self.queue) > 0:
-            print("Warning, worker left partial message: %s" % self.queue)
+            print("Warning, worker left partial message: %s" % str(self.queue.buffer))
         self.input.close()
@@ -3,6 +3,7 @@ import logging
 import os
 import re
 import tempfile
+import time
 import bb.data
 from bb.checksum import FileChecksumCache
 
@@ -86,6 +87,8 @@ class SignatureGeneratorBasic(SignatureGenerator):
         self.taints = {}
         self.gendeps = {}
         self.lookupcache = {}
+        # Seconds spent in each part of get_taskhash()
+        self.hash_timings = {"deps" : 0.0, "checksums" : 0.0, "taints" : 0.0}
         self.pkgnameextract = re.compile("(?P<fn>.*)\..*")
         self.basewhitelist = set((data.getVar("BB_HASHBASE_WHITELIST", True) or "").split())
         self.taskwhitelist = None
@@ -185,20 +188,26 @@ class SignatureGeneratorBasic(SignatureGenerator):
 
     def get_taskhash(self, fn, task, deps, dataCache):
         k = fn + "." + task
-        data = dataCache.basetaskhash[k]
+        # Feed the hash incrementally rather than building one large string
+        data = hashlib.md5(dataCache.basetaskhash[k])
         self.runtaskdeps[k] = []
         self.file_checksum_values[k] = []
         recipename = dataCache.pkg_fn[fn]
 
+        start = time.time()
         for dep in sorted(deps, key=clean_basepath):
             depname = dataCache.pkg_fn[self.pkgnameextract.search(dep).group('fn')]
             if not self.rundep_check(fn, recipename, task, dep, depname, dataCache):
                 continue
             if dep not in self.taskhash:
                 bb.fatal("%s is not in taskhash, caller isn't calling in dependency order?", dep)
-            data = data + self.taskhash[dep]
+            data.update(self.taskhash[dep])
             self.runtaskdeps[k].append(dep)
 
+        end = time.time()
+        self.hash_timings["deps"] += end - start
+        start = end
+
         if task in dataCache.file_checksums[fn]:
             if self.checksum_cache:
                 checksums = self.checksum_cache.get_checksums(dataCache.file_checksums[fn][task], recipename)
@@ -207,23 +216,29 @@ class SignatureGeneratorBasic(SignatureGenerator):
             for (f,cs) in checksums:
                 self.file_checksum_values[k].append((f,cs))
                 if cs:
-                    data = data + cs
+                    data.update(cs)
+
+        end = time.time()
+        self.hash_timings["checksums"] += end - start
+        start = end
 
         taskdep = dataCache.task_deps[fn]
         if 'nostamp' in taskdep and task in taskdep['nostamp']:
             # Nostamp tasks need an implicit taint so that they force any dependent tasks to run
             import uuid
             taint = str(uuid.uuid4())
-            data = data + taint
+            data.update(taint)
             self.taints[k] = "nostamp:" + taint
 
         taint = self.read_taint(fn, task, dataCache.stamp[fn])
         if taint:
-            data = data + taint
+            data.update(taint)
             self.taints[k] = taint
             logger.warn("%s is tainted from a forced run" % k)
 
-        h = hashlib.md5(data).hexdigest()
+        self.hash_timings["taints"] += time.time() - start
+
+        h = data.hexdigest()
         self.taskhash[k] = h
         #d.setVar("BB_TASKHASH_task-%s" % task, taskhash[task])
         return h
@@ -0,0 +1,323 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for cache.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import bb
+import bb.cache
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+logger = logging.getLogger('BitBake.TestCache')
+
+class Info(object):
+    def __init__(self, name):
+        self.name = name
+
+class RecipeInfoFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "bb_cache.dat")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def reload(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        self.assertIsNone(store.load())
+        return store
+
+    def test_roundtrip(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        self.assertEqual(store.load(), "Invalid cache")
+        store.save(dict(("/r/%s.bb" % i, Info(i)) for i in range(10)), [])
+        store.close()
+
+        store = self.reload()
+        self.assertEqual(sorted(store.index), sorted("/r/%s.bb" % i for i in range(10)))
+        self.assertEqual(store.get("/r/3.bb").name, 3)
+        store.close()
+
+    def test_append(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        store.save(dict(("/r/%s.bb" % i, Info(i)) for i in range(10)), [])
+        store.close()
+        size = os.path.getsize(self.path)
+
+        store = self.reload()
+        store.save({"/r/3.bb" : Info("changed")}, ["/r/4.bb"])
+        store.close()
+        # Appended to rather than rewritten
+        self.assertGreater(os.path.getsize(self.path), size)
+
+        store = self.reload()
+        self.assertEqual(store.get("/r/3.bb").name, "changed")
+        self.assertEqual(store.get("/r/5.bb").name, 5)
+        self.assertNotIn("/r/4.bb", store.index)
+        self.assertGreater(store.dead, 0)
+        store.close()
+
+    def test_compaction(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        store.save(dict(("/r/%s.bb" % i, Info(i)) for i in range(10)), [])
+        store.close()
+        for i in range(10):
+            store = self.reload()
+            store.save(dict(("/r/%s.bb" % i, Info("x" * 1000)) for i in range(10)), [])
+            store.close()
+        store = self.reload()
+        self.assertLessEqual(store.dead, os.path.getsize(self.path) // 2)
+        self.assertEqual(store.get("/r/9.bb").name, "x" * 1000)
+        store.close()
+
+    def test_interrupted_save(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        store.save({"/r/a.bb" : Info("a")}, [])
+        store.close()
+        # Data after the index, as left by a save which never updated the header
+        with open(self.path, "ab") as f:
+            f.write("garbage" * 100)
+
+        store = self.reload()
+        self.assertEqual(store.get("/r/a.bb").name, "a")
+        store.save({"/r/b.bb" : Info("b")}, [])
+        store.close()
+
+        store = self.reload()
+        self.assertEqual(store.get("/r/a.bb").name, "a")
+        self.assertEqual(store.get("/r/b.bb").name, "b")
+        store.close()
+
+    def test_version_mismatch(self):
+        store = bb.cache.RecipeInfoFile(self.path)
+        store.save({"/r/a.bb" : Info("a")}, [])
+        store.close()
+        oldversion = bb.cache.__cache_version__
+        bb.cache.__cache_version__ = "0"
+        try:
+            store = bb.cache.RecipeInfoFile(self.path)
+            self.assertEqual(store.load(), "Cache version mismatch")
+            self.assertEqual(store.index, {})
+        finally:
+            bb.cache.__cache_version__ = oldversion
+
+class RecipeInfoIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.stores = []
+        for name in ("core", "extra"):
+            store = bb.cache.RecipeInfoFile(os.path.join(self.tempdir, name))
+            store.save({"/r/a.bb" : Info(name + "a"), "/r/b.bb" : Info(name + "b")}, [])
+            store.close()
+            self.assertIsNone(store.load())
+            self.stores.append(store)
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_lazy_load(self):
+        index = bb.cache.RecipeInfoIndex(self.stores)
+        self.assertEqual(len(index), 2)
+        self.assertIn("/r/a.bb", index)
+        self.assertEqual(index.loaded, {})
+        self.assertEqual([info.name for info in index["/r/a.bb"]], ["corea", "extraa"])
+        self.assertEqual(list(index.loaded), ["/r/a.bb"])
+        self.assertRaises(KeyError, index.__getitem__, "/r/c.bb")
+
+    def test_changes(self):
+        index = bb.cache.RecipeInfoIndex(self.stores)
+        # Putting back an entry loaded from the cache doesn't make it dirty
+        index["/r/a.bb"] = index["/r/a.bb"]
+        self.assertEqual(index.dirty, set())
+        index["/r/c.bb"] = [Info("corec"), Info("extrac")]
+        del index["/r/b.bb"]
+        self.assertNotIn("/r/b.bb", index)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.dirty, set(["/r/c.bb"]))
+        self.assertEqual(index.removed, set(["/r/b.bb"]))
+
+class RecipeInfoSlotsTest(unittest.TestCase):
+
+    def test_pickle_skipped(self):
+        info = bb.cache.CoreRecipeInfo.__new__(bb.cache.CoreRecipeInfo)
+        info.pn = "foo"
+        info.skipped = True
+        info.skipreason = "Not compatible"
+        info.file_depends = None
+        info.provides = ["virtual/foo"]
+
+        copy = pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+        self.assertFalse(hasattr(copy, "__dict__"))
+        self.assertEqual(copy.pn, "foo")
+        self.assertEqual(copy.provides, ["virtual/foo"])
+        self.assertIsNone(copy.file_depends)
+        self.assertFalse(hasattr(copy, "file_checksums"))
+
+    def test_interned(self):
+        info = bb.cache.CoreRecipeInfo.__new__(bb.cache.CoreRecipeInfo)
+        info.depends = ["zlib-" + "native"]
+        info.rdepends_pkg = {"foo" : ["glib" + "-2.0"]}
+        first = pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+        second = pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+        self.assertIs(first.depends[0], second.depends[0])
+        self.assertIs(first.rdepends_pkg["foo"][0], second.rdepends_pkg["foo"][0])
+        self.assertIsNot(first.depends, second.depends)
+
+    def test_pickle_subclass(self):
+        # Slots of base classes are kept along with those of the subclass
+        info = CoreSubclassInfo.__new__(CoreSubclassInfo)
+        info.pn = "foo"
+        info.provides = ["virtual/foo"]
+        info.extra = "bar"
+        copy = pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.pn, "foo")
+        self.assertEqual(copy.provides, ["virtual/foo"])
+        self.assertEqual(copy.extra, "bar")
+        self.assertFalse(hasattr(copy, "skipped"))
+
+    def test_pickle_without_slots(self):
+        # Extra cache classes may keep their attributes in __dict__
+        for protocol in [0, 2]:
+            info = DictExtraInfo("bar")
+            copy = pickle.loads(pickle.dumps(info, protocol))
+            self.assertEqual(copy.foo, "bar")
+            self.assertEqual(copy.__dict__, {"foo" : "bar"})
+
+class CoreSubclassInfo(bb.cache.CoreRecipeInfo):
+    __slots__ = ('extra',)
+
+class DictExtraInfo(bb.cache.RecipeInfoCommon):
+    def __init__(self, foo):
+        self.foo = foo
+
+class DictRecipeInfo(object):
+    """ The RecipeInfo layout before the introduction of __slots__ """
+    pass
+
+class RecipeInfoMemoryBenchmark(unittest.TestCase):
+    """
+    Compare the memory used by a synthetic set of cached recipes with and
+    without __slots__ and interning.
+    """
+    RECIPES = 5000
+
+    def recipe_state(self, i):
+        names = ["lib%s" % (n % 300) for n in range(i, i + 12)]
+        pn = "recipe%s" % i
+        packages = [pn, pn + "-dev", pn + "-dbg", pn + "-doc", pn + "-locale"]
+        tasks = ["do_fetch", "do_unpack", "do_patch", "do_configure", "do_compile",
+                 "do_install", "do_package", "do_package_write_rpm", "do_build"]
+        return {
+            "file_depends" : [("/layers/meta/classes/%s.bbclass" % c, 1400000000.0) for c in ("base", "autotools", "pkgconfig")],
+            "timestamp" : 1400000000.0 + i,
+            "variants" : [""],
+            "appends" : [],
+            "nocache" : "",
+            "skipreason" : "",
+            "pn" : pn,
+            "skipped" : False,
+            "provides" : [],
+            "rprovides" : [],
+            "tasks" : tasks,
+            "packages" : packages,
+            "basetaskhashes" : dict((t, "%032x" % (i * 100 + n)) for n, t in enumerate(tasks)),
+            "hashfilename" : "",
+            "task_deps" : {"tasks" : tasks,
+                           "parents" : dict((t, tasks[:n]) for n, t in enumerate(tasks)),
+                           "depends" : {"do_fetch" : "xz-native:do_populate_sysroot",
+                                        "do_package" : "rpm-native:do_populate_sysroot"},
+                           "deptask" : {"do_configure" : "do_populate_sysroot"},
+                           "rdeptask" : {"do_package_write_rpm" : "do_packagedata"},
+                           "nostamp" : {}, "fakeroot" : {"do_install" : "1", "do_package" : "1"}},
+            "pe" : "",
+            "pv" : "1.%s" % i,
+            "pr" : "r0",
+            "defaultpref" : 0,
+            "not_world" : "",
+            "stamp" : "/build/tmp/stamps/core2-64-poky-linux/%s/1.%s-r0" % (pn, i),
+            "stampclean" : "/build/tmp/stamps/core2-64-poky-linux/%s/*-*" % pn,
+            "stamp_extrainfo" : dict((t, None) for t in tasks),
+            "file_checksums" : {},
+            "packages_dynamic" : ["^%s-locale-.*" % pn],
+            "depends" : ["virtual/x86_64-poky-linux-gcc", "virtual/libc", "autoconf-native",
+                         "automake-native", "libtool-native"] + names[:6],
+            "rdepends" : [],
+            "rrecommends" : [],
+            "rprovides_pkg" : dict((p, []) for p in packages),
+            "rdepends_pkg" : dict((p, names[6:] if p == pn else [pn]) for p in packages),
+            "rrecommends_pkg" : dict((p, ["glibc-gconv-utf-16"] if p == pn else []) for p in packages),
+            "inherits" : ["/layers/meta/classes/%s.bbclass" % c for c in ("base", "patch", "staging", "autotools", "pkgconfig", "package", "package_rpm")],
+            "fakerootenv" : "PSEUDO_PREFIX=/build/tmp/sysroots/x86_64-linux/usr",
+            "fakerootdirs" : "/build/tmp/sysroots/x86_64-linux/var/pseudo",
+            "fakerootnoenv" : "PSEUDO_UNLOAD=1",
+            "extradepsfunc" : "",
+        }
+
+    def deepsize(self, objs):
+        seen = set()
+        size = 0
+        stack = list(objs)
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            size = size + sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            elif isinstance(obj, bb.cache.RecipeInfoCommon):
+                stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+            elif hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+        return size
+
+    def test_memory(self):
+        before = []
+        after = []
+        for i in xrange(self.RECIPES):
+            # Each recipe arrives in its own pickle, as from the cache files
+            # or the parsing processes
+            old = pickle.loads(pickle.dumps(DictRecipeInfo(), pickle.HIGHEST_PROTOCOL))
+            old.__dict__.update(pickle.loads(pickle.dumps(self.recipe_state(i), pickle.HIGHEST_PROTOCOL)))
+            before.append(old)
+
+            info = bb.cache.CoreRecipeInfo.__new__(bb.cache.CoreRecipeInfo)
+            for name, value in self.recipe_state(i).iteritems():
+                setattr(info, name, value)
+            after.append(pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL)))
+
+        beforesize = self.deepsize(before)
+        aftersize = self.deepsize(after)
+        logger.info("%s recipes: %.1fMB with attribute dicts, %.1fMB with __slots__ and interning",
+                    self.RECIPES, beforesize / 1048576.0, aftersize / 1048576.0)
+        self.assertLess(aftersize, beforesize)
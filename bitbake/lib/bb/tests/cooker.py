@@ -0,0 +1,105 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for cooker.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import bb
+import bb.cooker
+
+class CookerCollectFilesTest(unittest.TestCase):
+
+    bbappends = [
+        "layer1/foo_1.0.bbappend",
+        "layer1/foo_%.bbappend",
+        "layer1/%.bbappend",
+        "layer2/foo_1.%.bbappend",
+        "layer2/foo_1.0.bbappend",
+        "layer2/fo%.bbappend",
+        "layer2/foo_1.0-long%.bbappend",
+        "layer2/bar_%.bbappend",
+        "layer3/foo_%.bbappend",
+        "layer3/foo_1.0.bb%.bbappend",
+    ]
+
+    recipes = [
+        "/recipes/foo_1.0.bb",
+        "/recipes/foo_1.1.bb",
+        "/recipes/foo_2.0.bb",
+        "/recipes/foo.bb",
+        "/recipes/fo.bb",
+        "/recipes/f.bb",
+        "/recipes/bar_git.bb",
+        "/recipes/baz_1.0.bb",
+        "/recipes/.bb",
+    ]
+
+    def setUp(self):
+        self.collection = bb.cooker.CookerCollectFiles([])
+        for f in self.bbappends:
+            self.collection.bbappends.append((f.split("/")[-1].replace(".bbappend", ".bb"), f))
+        self.collection.index_bbappends()
+
+    def expected(self, fn):
+        # The linear search get_file_appends() used before the index
+        f = fn.split("/")[-1]
+        filelist = []
+        for (bbappend, filename) in self.collection.bbappends:
+            if (bbappend == f) or ('%' in bbappend and bbappend.startswith(f[:bbappend.index('%')])):
+                filelist.append(filename)
+        return filelist
+
+    def test_exact(self):
+        appends = self.collection.get_file_appends("/recipes/foo_1.0.bb")
+        self.assertIn("layer1/foo_1.0.bbappend", appends)
+        self.assertIn("layer2/foo_1.0.bbappend", appends)
+        appends = self.collection.get_file_appends("/recipes/foo_1.1.bb")
+        self.assertNotIn("layer1/foo_1.0.bbappend", appends)
+        self.assertNotIn("layer2/foo_1.0.bbappend", appends)
+        self.assertEqual(self.collection.get_file_appends("/recipes/baz_1.0.bb"),
+                         ["layer1/%.bbappend"])
+
+    def test_wildcards(self):
+        self.assertEqual(self.collection.get_file_appends("/recipes/foo_1.0.bb"),
+                         ["layer1/foo_1.0.bbappend",
+                          "layer1/foo_%.bbappend",
+                          "layer1/%.bbappend",
+                          "layer2/foo_1.%.bbappend",
+                          "layer2/foo_1.0.bbappend",
+                          "layer2/fo%.bbappend",
+                          "layer3/foo_%.bbappend",
+                          "layer3/foo_1.0.bb%.bbappend"])
+
+    def test_short_name(self):
+        # A name shorter than the prefix is compared including its ".bb"
+        self.assertEqual(self.collection.get_file_appends("/recipes/fo.bb"),
+                         ["layer1/%.bbappend",
+                          "layer2/fo%.bbappend"])
+        self.assertEqual(self.collection.get_file_appends("/recipes/foo_1.0.bb"),
+                         self.expected("/recipes/foo_1.0.bb"))
+        self.assertNotIn("layer2/foo_1.0-long%.bbappend", self.collection.get_file_appends("/recipes/foo_1.0.bb"))
+        self.assertIn("layer3/foo_1.0.bb%.bbappend", self.collection.get_file_appends("/recipes/foo_1.0.bb"))
+
+    def test_empty_prefix(self):
+        for fn in self.recipes:
+            self.assertIn("layer1/%.bbappend", self.collection.get_file_appends(fn))
+
+    def test_matches_linear_search(self):
+        for fn in self.recipes:
+            self.assertEqual(self.collection.get_file_appends(fn), self.expected(fn))
+            # Cached results are the same
+            self.assertEqual(self.collection.get_file_appends(fn), self.expected(fn))
@@ -224,6 +224,72 @@ class TestMemoize(unittest.TestCase):
         self.assertEqual(d.getVar("foo", False),
                          d.getVar("bar", False))
 
+class TestExpandCache(unittest.TestCase):
+    def setUp(self):
+        self.d = bb.data.init()
+        self.d.setVar("A", "a")
+        self.d.setVar("B", "${A}b")
+        self.d.setVar("C", "${B}c")
+        self.d.setVar("D", "d")
+        self.d.setVar("P", "${@d.getVar('D', True)}p")
+        for var in ("A", "B", "C", "D", "P"):
+            self.d.getVar(var, True)
+
+    def test_unrelated_write(self):
+        self.d.setVar("E", "e")
+        self.assertIn("C", self.d.expand_cache)
+        self.d.setVarFlag("C", "doc", "c")
+        self.assertIn("C", self.d.expand_cache)
+
+    def test_dependent_write(self):
+        self.d.setVar("A", "x")
+        self.assertIn("D", self.d.expand_cache)
+        self.assertNotIn("B", self.d.expand_cache)
+        self.assertNotIn("C", self.d.expand_cache)
+        self.assertEqual(self.d.getVar("C", True), "xbc")
+
+    def test_variants(self):
+        self.d.setVar("B_append", "+")
+        self.assertNotIn("C", self.d.expand_cache)
+        self.assertEqual(self.d.getVar("C", True), "ab+c")
+        self.d.setVar("B_foo", "foo")
+        self.d.setVar("OVERRIDES", "foo")
+        self.assertEqual(self.d.getVar("C", True), "foo+c")
+
+    def test_remove(self):
+        self.d.setVar("R", "a b c")
+        self.d.setVar("R_remove", "${A}")
+        self.assertEqual(self.d.getVar("R", True), "b c")
+        self.d.setVar("A", "b")
+        self.assertEqual(self.d.getVar("R", True), "a c")
+
+    def test_python(self):
+        self.d.setVar("E", "e")
+        self.assertNotIn("P", self.d.expand_cache)
+        self.d.setVar("D", "x")
+        self.assertEqual(self.d.getVar("P", True), "xp")
+
+    def test_flags(self):
+        self.d.setVarFlag("F", "doc", "${A}")
+        self.assertEqual(self.d.getVarFlag("F", "doc", True), "a")
+        self.d.setVar("A", "x")
+        self.assertEqual(self.d.getVarFlag("F", "doc", True), "x")
+        self.d.setVarFlag("F", "doc", "${D}")
+        self.assertEqual(self.d.getVarFlag("F", "doc", True), "d")
+
+    def test_stats(self):
+        stats = bb.data_smart.enable_expand_cache_stats()
+        try:
+            stats.reset()
+            self.d.getVar("C", True)
+            self.d.setVar("A", "x")
+            self.d.getVar("C", True)
+            self.assertEqual(stats.hits, 1)
+            self.assertEqual(stats.misses, 3)
+            self.assertEqual(stats.invalidated, 4)
+        finally:
+            bb.data_smart.expand_cache_stats = None
+
 class TestConcat(unittest.TestCase):
     def setUp(self):
         self.d = bb.data.init()
@@ -444,3 +510,46 @@ class Contains(unittest.TestCase):
 
         self.assertFalse(bb.utils.contains_any("SOMEFLAG", "x", True, False, self.d))
         self.assertFalse(bb.utils.contains_any("SOMEFLAG", "x y z", True, False, self.d))
+
+class TestHash(unittest.TestCase):
+    def setUp(self):
+        self.d = bb.data.init()
+        self.d.setVar("BB_HASHCONFIG_WHITELIST", "DATE")
+        self.d.setVar("A", "a")
+        self.d.setVar("B", "${A}")
+        self.d.setVarFlag("B", "doc", "b")
+        self.d.setVar("__BBTASKS", ["do_a", "do_b"])
+        self.hash = self.d.get_hash()
+
+    def fresh_hash(self):
+        return bb.data.createCopy(self.d).get_hash()
+
+    def test_unchanged(self):
+        self.assertEqual(self.d.get_hash(), self.hash)
+        self.assertEqual(self.fresh_hash(), self.hash)
+
+    def test_writes(self):
+        self.d.setVar("A", "x")
+        self.assertNotEqual(self.d.get_hash(), self.hash)
+        self.assertEqual(self.d.get_hash(), self.fresh_hash())
+        self.d.setVar("A", "a")
+        self.assertEqual(self.d.get_hash(), self.hash)
+
+        self.d.setVarFlag("B", "doc", "x")
+        self.assertNotEqual(self.d.get_hash(), self.hash)
+        self.assertEqual(self.d.get_hash(), self.fresh_hash())
+        self.d.delVarFlag("B", "doc")
+        self.assertEqual(self.d.get_hash(), self.fresh_hash())
+
+        self.d.setVar("B_append", "x")
+        self.assertEqual(self.d.get_hash(), self.fresh_hash())
+        self.d.delVar("B")
+        self.assertEqual(self.d.get_hash(), self.fresh_hash())
+
+    def test_excluded(self):
+        self.d.setVar("DATE", "20160101")
+        self.d.setVar("__depends", [("file", 1)])
+        self.d.setVar("__BBTASKS", ["do_b", "do_a"])
+        self.assertEqual(self.d.get_hash(), self.hash)
+        self.d.setVar("__BBTASKS", ["do_a"])
+        self.assertNotEqual(self.d.get_hash(), self.hash)
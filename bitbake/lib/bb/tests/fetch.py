@@ -23,6 +23,7 @@ import unittest
 import tempfile
 import subprocess
 import os
+import time
 from bb.fetch2 import URI
 from bb.fetch2 import FetchMethod
 import bb
@@ -504,6 +505,156 @@ class FetcherLocalTest(FetcherTest):
         tree = self.fetchUnpack(['file://dir/subdir/e;subdir=bar'])
         self.assertEqual(tree, ['bar/dir/subdir/e'])
 
+class SleepFetch(FetchMethod):
+    """
+    Fetcher for sleep:// urls which records when each download ran
+    """
+    def supports(self, ud, d):
+        return ud.type == "sleep"
+
+    def supports_checksum(self, ud):
+        return False
+
+    def urldata_init(self, ud, d):
+        ud.localfile = os.path.basename(ud.path)
+
+    def download(self, ud, d):
+        if ud.localfile == "fail":
+            raise bb.fetch2.FetchError("Download failed", ud.url)
+        start = time.time()
+        time.sleep(0.5)
+        with open(ud.localpath, "w") as f:
+            f.write("%s %s %s\n" % (os.getpid(), start, time.time()))
+
+class FetcherParallelTest(FetcherTest):
+    def setUp(self):
+        super(FetcherParallelTest, self).setUp()
+        self.method = SleepFetch()
+        bb.fetch2.methods.append(self.method)
+        self.d.setVar("BB_NUMBER_FETCH_THREADS", "4")
+        self.urls = ["sleep://host/%s" % name for name in "abcd"]
+
+    def tearDown(self):
+        bb.fetch2.methods.remove(self.method)
+        super(FetcherParallelTest, self).tearDown()
+
+    def test_parallel(self):
+        fetcher = bb.fetch.Fetch(self.urls, self.d)
+        fetcher.download()
+        runs = []
+        for name in "abcd":
+            self.assertTrue(os.path.exists(os.path.join(self.dldir, name + ".done")))
+            with open(os.path.join(self.dldir, name)) as f:
+                pid, start, end = f.read().split()
+                runs.append((float(start), float(end)))
+        # All the downloads overlapped
+        self.assertTrue(max(start for start, end in runs) < min(end for start, end in runs))
+
+        # Completed downloads are not repeated
+        os.unlink(os.path.join(self.dldir, "a"))
+        with open(os.path.join(self.dldir, "a"), "w") as f:
+            f.write("kept")
+        bb.fetch.Fetch(self.urls, self.d).download()
+        with open(os.path.join(self.dldir, "a")) as f:
+            self.assertEqual(f.read(), "kept")
+
+    def test_failure(self):
+        fetcher = bb.fetch.Fetch(["sleep://host/fail"] + self.urls, self.d)
+        with self.assertRaises(bb.fetch2.FetchError):
+            fetcher.download()
+        self.assertFalse(os.path.exists(os.path.join(self.dldir, "fail.done")))
+        # The downloads already started still complete
+        self.assertTrue(os.path.exists(os.path.join(self.dldir, "a.done")))
+
+    def test_premirror(self):
+        mirrordir = os.path.join(self.tempdir, "mirror")
+        os.mkdir(mirrordir)
+        with open(os.path.join(mirrordir, "b"), "w") as f:
+            f.write("mirror")
+        self.d.setVar("PREMIRRORS", "sleep://.*/b file://%s/b" % mirrordir)
+        fetcher = bb.fetch.Fetch(self.urls, self.d)
+        fetcher.download()
+        with open(os.path.join(self.dldir, "b")) as f:
+            self.assertEqual(f.read(), "mirror")
+        self.assertTrue(os.path.exists(os.path.join(self.dldir, "b.done")))
+
+class GitShallowTest(FetcherTest):
+    def setUp(self):
+        super(GitShallowTest, self).setUp()
+        self.srcdir = os.path.join(self.tempdir, "gitsource")
+        os.mkdir(self.srcdir)
+        self.git("init")
+        for i in range(5):
+            with open(os.path.join(self.srcdir, "file"), "w") as f:
+                f.write("%s\n" % i)
+            self.git("add file")
+            self.git("-c user.name=Test -c user.email=test@example.com commit -m commit%s" % i)
+        self.rev = self.git("rev-parse HEAD").strip()
+        self.branch = self.git("rev-parse --abbrev-ref HEAD").strip()
+        self.url = "git://%s;protocol=file;branch=%s" % (self.srcdir, self.branch)
+        self.mirrordir = os.path.join(self.tempdir, "mirror")
+        self.d.setVar("SRCREV", self.rev)
+        self.d.setVar("BB_GIT_SHALLOW_DEPTH", "2")
+
+    def git(self, cmd, cwd=None):
+        return bb.process.run("git %s" % cmd, cwd=cwd or self.srcdir)[0]
+
+    def make_mirror(self):
+        # Build the mirror tarballs in a separate DL_DIR
+        d = bb.data.createCopy(self.d)
+        d.setVar("DL_DIR", self.mirrordir)
+        d.setVar("BB_GENERATE_MIRROR_TARBALLS", "1")
+        d.setVar("BB_GENERATE_SHALLOW_TARBALLS", "1")
+        bb.fetch.Fetch([self.url], d).download()
+        return bb.fetch.Fetch([self.url], d).ud[self.url]
+
+    def test_mirroruris(self):
+        self.d.setVar("BB_GIT_SHALLOW", "1")
+        ud = bb.fetch.FetchData(self.url, self.d)
+        mirrors = bb.fetch2.mirror_from_string("git://.*/.* http://somewhere.org/somedir/")
+        uris, uds = bb.fetch2.build_mirroruris(ud, mirrors, self.d)
+        self.assertEqual(uris, ["http://somewhere.org/somedir/" + ud.shallowtarball,
+                                "http://somewhere.org/somedir/" + ud.mirrortarball])
+
+    def test_shallow_tarball(self):
+        mirrorud = self.make_mirror()
+        self.assertTrue(os.path.exists(mirrorud.fullshallow + ".done"))
+        self.assertTrue(os.path.exists(mirrorud.fullmirror + ".done"))
+
+        self.d.setVar("BB_GIT_SHALLOW", "1")
+        self.d.setVar("BB_NO_NETWORK", "1")
+        self.d.setVar("PREMIRRORS", "git://.*/.* file://%s/ \n" % self.mirrordir)
+        fetcher = bb.fetch.Fetch([self.url], self.d)
+        fetcher.download()
+        ud = fetcher.ud[self.url]
+        self.assertTrue(os.path.exists(os.path.join(self.dldir, ud.shallowtarball)))
+        self.assertFalse(os.path.exists(os.path.join(self.dldir, ud.mirrortarball)))
+        history = self.git("log --format=%H " + self.rev, cwd=ud.clonedir).split()
+        self.assertEqual(history[0], self.rev)
+        self.assertEqual(len(history), 2)
+
+    def test_full_fallback(self):
+        self.make_mirror()
+
+        # No shallow tarball of depth 3 exists so the full one is used
+        self.d.setVar("BB_GIT_SHALLOW", "1")
+        self.d.setVar("BB_GIT_SHALLOW_DEPTH", "3")
+        self.d.setVar("BB_NO_NETWORK", "1")
+        self.d.setVar("PREMIRRORS", "git://.*/.* file://%s/ \n" % self.mirrordir)
+        fetcher = bb.fetch.Fetch([self.url], self.d)
+        fetcher.download()
+        ud = fetcher.ud[self.url]
+        self.assertFalse(os.path.exists(os.path.join(self.dldir, ud.shallowtarball)))
+        self.assertTrue(os.path.exists(os.path.join(self.dldir, ud.mirrortarball)))
+        history = self.git("log --format=%H " + self.rev, cwd=ud.clonedir).split()
+        self.assertEqual(len(history), 5)
+
+    def test_invalid_depth(self):
+        self.d.setVar("BB_GIT_SHALLOW", "1")
+        self.d.setVar("BB_GIT_SHALLOW_DEPTH", "0")
+        with self.assertRaises(bb.fetch2.FetchError):
+            bb.fetch.FetchData(self.url, self.d)
+
 class FetcherNetworkTest(FetcherTest):
 
     if os.environ.get("BB_SKIP_NETTESTS") == "yes":
@@ -0,0 +1,139 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for framing.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import logging
+import os
+import select
+import time
+import bb
+import bb.event
+import bb.utils
+from bb import framing
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+logger = logging.getLogger('BitBake.TestFraming')
+
+class FramingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pipein, self.pipeout = os.pipe()
+        bb.utils.nonblockingfd(self.pipein)
+        bb.utils.nonblockingfd(self.pipeout)
+
+    def tearDown(self):
+        for fd in (self.pipein, self.pipeout):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def test_roundtrip(self):
+        writer = framing.FrameWriter(self.pipeout)
+        writer.write(framing.encode_pickle("event", {"a" : 1}))
+        writer.write(framing.encode("quit"))
+        writer.write(framing.encode_pickle("exitcode", (5, 0)))
+        writer.flush()
+        self.assertEqual(len(writer), 0)
+
+        reader = framing.FrameReader(self.pipein)
+        self.assertTrue(reader.fill())
+        frames = reader.frames()
+        self.assertEqual([msgtype for msgtype, _ in frames], ["event", "quit", "exitcode"])
+        self.assertEqual(pickle.loads(frames[0][1]), {"a" : 1})
+        self.assertEqual(frames[1][1], "")
+        self.assertEqual(pickle.loads(frames[2][1]), (5, 0))
+        self.assertEqual(len(reader), 0)
+
+    def test_partial_frames(self):
+        data = framing.encode("event", "x" * 1000) + framing.encode("ping")
+        reader = framing.FrameReader(self.pipein)
+        frames = []
+        for i in xrange(0, len(data), 7):
+            os.write(self.pipeout, data[i:i+7])
+            reader.fill()
+            frames.extend(reader.frames())
+        self.assertEqual(frames, [("event", "x" * 1000), ("ping", "")])
+
+    def test_binary_payload(self):
+        # Binary pickles may contain anything, including the old text markers
+        payload = "</event>\x00\xff" * 10
+        os.write(self.pipeout, framing.encode("event", payload))
+        reader = framing.FrameReader(self.pipein)
+        reader.fill()
+        self.assertEqual(reader.frames(), [("event", payload)])
+
+    def test_eof_and_eagain(self):
+        reader = framing.FrameReader(self.pipein)
+        self.assertIsNone(reader.fill())
+        os.close(self.pipeout)
+        self.assertEqual(reader.fill(), 0)
+
+class FramingThroughputBenchmark(unittest.TestCase):
+    """
+    Measure event throughput through a pipe using the worker framing, with
+    a forked writer standing in for bitbake-worker.
+    """
+    EVENTS = 20000
+
+    def test_event_throughput(self):
+        pipein, pipeout = os.pipe()
+        event = bb.event.MetadataEvent("Benchmark", {"payload" : "x" * 200})
+
+        pid = os.fork()
+        if pid == 0:
+            os.close(pipein)
+            try:
+                bb.utils.nonblockingfd(pipeout)
+                writer = framing.FrameWriter(pipeout)
+                for i in xrange(self.EVENTS):
+                    writer.write(framing.encode_pickle("event", event))
+                    writer.flush()
+                while len(writer):
+                    select.select([], [pipeout], [], 1)
+                    writer.flush()
+            finally:
+                os._exit(0)
+
+        os.close(pipeout)
+        bb.utils.nonblockingfd(pipein)
+        reader = framing.FrameReader(pipein)
+        received = 0
+        start = time.time()
+        try:
+            while True:
+                select.select([pipein], [], [], 1)
+                read = reader.fill()
+                for msgtype, payload in reader.frames():
+                    pickle.loads(payload)
+                    received = received + 1
+                if read == 0:
+                    break
+        finally:
+            os.close(pipein)
+            os.waitpid(pid, 0)
+        elapsed = time.time() - start
+
+        logger.info("Passed %s events through the worker pipe in %.2fs (%.0f events/s)",
+                    received, elapsed, received / max(elapsed, 1e-6))
+        self.assertEqual(received, self.EVENTS)
@@ -24,6 +24,7 @@ import tempfile
 import logging
 import bb
 import os
+import shutil
 
 logger = logging.getLogger('BitBake.TestParse')
 
@@ -145,3 +146,49 @@ python () {
         self.assertEqual(d1.getVar("VAR_var", True), "B")
         self.assertEqual(d2.getVar("VAR_var", True), None)
 
+
+class StatementCacheTest(unittest.TestCase):
+
+    testfile = """
+A = "1"
+do_install() {
+	echo "hello"
+}
+"""
+
+    def setUp(self):
+        self.d = bb.data.init()
+        bb.parse.siggen = bb.siggen.init(self.d)
+        self.tempdir = tempfile.mkdtemp()
+        self.d.setVar("PERSISTENT_DIR", self.tempdir)
+        bb.parse.BBHandler.init_statement_cache(self.d)
+        self.recipe = os.path.join(self.tempdir, "recipe.bb")
+        with open(self.recipe, "w") as f:
+            f.write(self.testfile)
+        self.feeder = bb.parse.BBHandler.feeder
+
+    def tearDown(self):
+        bb.parse.BBHandler.feeder = self.feeder
+        bb.parse.BBHandler.statement_cache_dir = None
+        shutil.rmtree(self.tempdir)
+
+    def disable_feeder(self):
+        def feeder(*args, **kwargs):
+            self.fail("File parsed instead of using the statement cache")
+        bb.parse.BBHandler.feeder = feeder
+
+    def test_cached_statements(self):
+        d = bb.parse.handle(self.recipe, bb.data.createCopy(self.d))['']
+        self.assertEqual(len(os.listdir(os.path.join(self.tempdir, "bb_statements"))), 1)
+
+        self.disable_feeder()
+        d2 = bb.parse.handle(self.recipe, bb.data.createCopy(self.d))['']
+        self.assertEqual(d2.getVar("A", True), "1")
+        self.assertEqual(d2.getVar("do_install", False), d.getVar("do_install", False))
+
+    def test_changed_file(self):
+        bb.parse.handle(self.recipe, bb.data.createCopy(self.d))
+        with open(self.recipe, "a") as f:
+            f.write('B = "2"\n')
+        d = bb.parse.handle(self.recipe, bb.data.createCopy(self.d))['']
+        self.assertEqual(d.getVar("B", True), "2")
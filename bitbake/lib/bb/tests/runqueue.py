@@ -0,0 +1,368 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for runqueue.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import logging
+import random
+import time
+import os
+import shutil
+import tempfile
+import bb
+import bb.parse
+import bb.build
+import bb.siggen
+import bb.data
+import bb.runqueue
+import bb.admission
+
+logger = logging.getLogger('BitBake.TestRunQueue')
+
+class Dummy(object):
+    pass
+
+class SchedulerTestBase(unittest.TestCase):
+    """
+    Build a synthetic runqueue with just enough state for the schedulers;
+    TASKS_PER_FILE tasks per recipe with random weights.
+    """
+    TASKS_PER_FILE = 10
+
+    def setUp(self):
+        self.origsiggen = getattr(bb.parse, "siggen", None)
+        bb.parse.siggen = bb.siggen.SignatureGenerator(None)
+
+    def tearDown(self):
+        bb.parse.siggen = self.origsiggen
+
+    def make_runqueue(self, numtasks, seed=0):
+        rnd = random.Random(seed)
+        numfiles = (numtasks + self.TASKS_PER_FILE - 1) // self.TASKS_PER_FILE
+
+        rqdata = Dummy()
+        rqdata.runq_fnid = [task // self.TASKS_PER_FILE for task in xrange(numtasks)]
+        rqdata.runq_task = ["do_task%s" % (task % self.TASKS_PER_FILE) for task in xrange(numtasks)]
+        rqdata.runq_weight = [rnd.randint(0, 100) for task in xrange(numtasks)]
+        rqdata.runq_depends = [set() for task in xrange(numtasks)]
+        rqdata.runq_revdeps = [set() for task in xrange(numtasks)]
+        rqdata.taskData = Dummy()
+        rqdata.taskData.fn_index = ["/recipes/recipe%s.bb" % fnid for fnid in xrange(numfiles)]
+        rqdata.dataCache = Dummy()
+        rqdata.dataCache.stamp = dict((fn, "/stamps/" + fn) for fn in rqdata.taskData.fn_index)
+        rqdata.dataCache.stamp_extrainfo = dict((fn, {}) for fn in rqdata.taskData.fn_index)
+        rqdata.dataCache.pkg_fn = dict((fn, "recipe%s" % fnid) for fnid, fn in enumerate(rqdata.taskData.fn_index))
+        rqdata.dataCache.pkg_pepvpr = dict((fn, (None, "1.0", "r0")) for fn in rqdata.taskData.fn_index)
+        rqdata.dataCache.task_deps = dict((fn, {}) for fn in rqdata.taskData.fn_index)
+
+        rq = Dummy()
+        rq.runq_buildable = [1] * numtasks
+        rq.runq_running = [0] * numtasks
+        rq.build_stamps2 = set()
+        rq.number_tasks = 4
+        rq.stats = bb.runqueue.RunQueueStats(numtasks)
+        rq.cfgData = bb.data.init()
+        rq.rqdata = rqdata
+        self.setup_admission(rq)
+
+        return rq, rqdata
+
+    def setup_admission(self, rq):
+        rq.admission = bb.admission.TaskAdmission(rq, rq.cfgData)
+
+    def drain(self, sched, rq):
+        order = []
+        while True:
+            task = sched.next_buildable_task()
+            if task is None:
+                return order
+            rq.runq_running[task] = 1
+            order.append(task)
+
+class SchedulerOrderTest(SchedulerTestBase):
+
+    def test_basic_order(self):
+        rq, rqdata = self.make_runqueue(50)
+        sched = bb.runqueue.RunQueueScheduler(rq, rqdata)
+        self.assertEqual(self.drain(sched, rq), range(50))
+
+    def test_speed_order(self):
+        rq, rqdata = self.make_runqueue(500)
+        sched = bb.runqueue.RunQueueSchedulerSpeed(rq, rqdata)
+        weights = rqdata.runq_weight
+        expected = sorted(xrange(500), key=lambda task: (weights[task], task), reverse=True)
+        self.assertEqual(sched.prio_map, expected)
+        self.assertEqual(self.drain(sched, rq), expected)
+
+    def test_completion_groups_files(self):
+        rq, rqdata = self.make_runqueue(500)
+        speed = bb.runqueue.RunQueueSchedulerSpeed(rq, rqdata)
+        sched = bb.runqueue.RunQueueSchedulerCompletion(rq, rqdata)
+        self.assertEqual(sorted(sched.prio_map), range(500))
+        # Each recipe's tasks are contiguous, in speed order, with recipes
+        # ordered by their first appearance in the speed order
+        fnids = [rqdata.runq_fnid[task] for task in sched.prio_map]
+        seen = []
+        for fnid in fnids:
+            if not seen or seen[-1] != fnid:
+                self.assertNotIn(fnid, seen)
+                seen.append(fnid)
+        firstseen = []
+        for task in speed.prio_map:
+            if rqdata.runq_fnid[task] not in firstseen:
+                firstseen.append(rqdata.runq_fnid[task])
+        self.assertEqual(seen, firstseen)
+        for fnid in seen:
+            self.assertEqual([t for t in sched.prio_map if rqdata.runq_fnid[t] == fnid],
+                             [t for t in speed.prio_map if rqdata.runq_fnid[t] == fnid])
+
+    def test_newbuildable(self):
+        rq, rqdata = self.make_runqueue(20)
+        rq.runq_buildable = [0] * 20
+        sched = bb.runqueue.RunQueueScheduler(rq, rqdata)
+        self.assertIsNone(sched.next_buildable_task())
+        sched.newbuilable(7)
+        sched.newbuilable(3)
+        self.assertEqual(sched.next_buildable_task(), 3)
+        rq.runq_running[3] = 1
+        self.assertEqual(sched.next_buildable_task(), 7)
+
+    def test_stamp_in_use(self):
+        rq, rqdata = self.make_runqueue(20)
+        sched = bb.runqueue.RunQueueScheduler(rq, rqdata)
+        rq.build_stamps2.add(sched.stamps[0])
+        self.assertEqual(sched.next_buildable_task(), 1)
+        rq.runq_running[1] = 1
+        rq.build_stamps2.discard(sched.stamps[0])
+        self.assertEqual(sched.next_buildable_task(), 0)
+
+    def test_next_respects_thread_limit(self):
+        rq, rqdata = self.make_runqueue(20)
+        sched = bb.runqueue.RunQueueScheduler(rq, rqdata)
+        rq.stats.active = rq.number_tasks
+        self.assertIsNone(sched.next())
+        rq.stats.active = 0
+        self.assertEqual(sched.next(), 0)
+
+class CriticalSchedulerTest(SchedulerTestBase):
+    TASKS_PER_FILE = 1
+
+    def setUp(self):
+        SchedulerTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        SchedulerTestBase.tearDown(self)
+
+    def write_buildstat(self, build, pf, taskname, elapsed):
+        taskdir = os.path.join(self.tempdir, build, pf)
+        bb.utils.mkdirhier(taskdir)
+        with open(os.path.join(taskdir, taskname), "w") as f:
+            f.write("Event: TaskStarted \n")
+            f.write("%s: %s: Elapsed time: %0.2f seconds \n" % (pf, taskname, elapsed))
+
+    def test_no_history_matches_speed(self):
+        rq, rqdata = self.make_runqueue(200)
+        rq.cfgData.setVar("BUILDSTATS_BASE", os.path.join(self.tempdir, "missing"))
+        speed = bb.runqueue.RunQueueSchedulerSpeed(rq, rqdata)
+        sched = bb.runqueue.RunQueueSchedulerCritical(rq, rqdata)
+        self.assertEqual(sched.prio_map, speed.prio_map)
+
+    def test_critical_path_order(self):
+        rq, rqdata = self.make_runqueue(5)
+        rqdata.runq_task = ["do_fetch", "do_compile", "do_compile", "do_install", "do_install"]
+        rqdata.runq_weight = [1, 1, 1, 1, 100]
+        # Task 1 depends on task 0
+        rqdata.runq_depends[1].add(0)
+        rqdata.runq_revdeps[0].add(1)
+        rq.runq_buildable[1] = 0
+
+        self.write_buildstat("old", "recipe0-1.0-r0", "do_fetch", 10)
+        self.write_buildstat("old", "recipe2-1.0-r0", "do_compile", 500)
+        self.write_buildstat("new", "recipe1-1.0-r0", "do_compile", 100)
+        self.write_buildstat("new", "recipe2-1.0-r0", "do_compile", 50)
+        self.write_buildstat("new", "recipe3-1.0-r0", "do_install", 20)
+        self.write_buildstat("current", "recipe3-1.0-r0", "do_install", 1000)
+        os.utime(os.path.join(self.tempdir, "old"), (1000, 1000))
+        os.utime(os.path.join(self.tempdir, "new"), (2000, 2000))
+        rq.cfgData.setVar("BUILDSTATS_BASE", self.tempdir)
+        rq.cfgData.setVar("BUILDNAME", "current")
+
+        sched = bb.runqueue.RunQueueSchedulerCritical(rq, rqdata)
+        # Task 4 has no history so is estimated from task 3; the weights
+        # then put it ahead of task 3
+        self.assertEqual(sched.prio_map, [0, 1, 2, 4, 3])
+        self.assertEqual(self.drain(sched, rq), [0, 2, 4, 3])
+
+class AdmissionTest(SchedulerTestBase):
+    TASKS_PER_FILE = 1
+
+    def set_resources(self, rqdata, task, resclass, weight=None):
+        fn = rqdata.taskData.fn_index[rqdata.runq_fnid[task]]
+        taskname = rqdata.runq_task[task]
+        taskdep = rqdata.dataCache.task_deps[fn]
+        taskdep.setdefault('resource_class', {})[taskname] = resclass
+        if weight is not None:
+            taskdep.setdefault('resource_weight', {})[taskname] = str(weight)
+
+    def test_class_budget(self):
+        rq, rqdata = self.make_runqueue(6)
+        for task in xrange(4):
+            self.set_resources(rqdata, task, "cpu", 2)
+        self.set_resources(rqdata, 4, "io")
+        rq.cfgData.setVar("BB_RESOURCE_BUDGET", "cpu:4 io:1")
+        self.setup_admission(rq)
+        sched = bb.runqueue.RunQueueScheduler(rq, rqdata)
+
+        started = []
+        for i in xrange(4):
+            task = sched.next_buildable_task()
+            rq.runq_running[task] = 1
+            rq.admission.task_started(task)
+            started.append(task)
+        # Only two cpu tasks fit the budget so the io and unclassified tasks
+        # are started ahead of the remaining cpu tasks
+        self.assertEqual(started, [0, 1, 4, 5])
+        self.assertIsNone(sched.next_buildable_task())
+        rq.admission.task_finished(0)
+        self.assertEqual(sched.next_buildable_task(), 2)
+
+    def test_budget_released(self):
+        rq, rqdata = self.make_runqueue(3)
+        for task in xrange(3):
+            self.set_resources(rqdata, task, "cpu", 8)
+        rq.cfgData.setVar("BB_RESOURCE_BUDGET", "cpu:4")
+        self.setup_admission(rq)
+        # An oversized task can still run on its own
+        self.assertTrue(rq.admission.can_start(0))
+        rq.admission.task_started(0)
+        self.assertFalse(rq.admission.can_start(1))
+        rq.admission.task_finished(0)
+        self.assertTrue(rq.admission.can_start(1))
+
+    def test_host_pressure(self):
+        rq, rqdata = self.make_runqueue(3)
+        rq.cfgData.setVar("BB_LOADAVG_MAX", "4")
+        rq.cfgData.setVar("BB_NUMBER_THREADS_MAX", "6")
+        self.setup_admission(rq)
+        rq.admission.interval = 0
+        loadavg = [8.0]
+        origread = bb.admission.read_loadavg
+        bb.admission.read_loadavg = lambda: loadavg[0]
+        try:
+            self.assertEqual(rq.admission.max_active(), 1)
+            loadavg[0] = 1.0
+            self.assertEqual(rq.admission.max_active(), rq.number_tasks + 1)
+            self.assertEqual(rq.admission.max_active(), rq.number_tasks + 2)
+            self.assertEqual(rq.admission.max_active(), rq.number_tasks + 2)
+            loadavg[0] = 5.0
+            self.assertEqual(rq.admission.max_active(), 1)
+        finally:
+            bb.admission.read_loadavg = origread
+
+    def test_invalid_values(self):
+        rq, rqdata = self.make_runqueue(3)
+        self.set_resources(rqdata, 1, "cpu", "four")
+        self.assertRaises(bb.BBHandledException, self.setup_admission, rq)
+        self.set_resources(rqdata, 1, "cpu", 4)
+        self.setup_admission(rq)
+        for var, value in [("BB_NUMBER_THREADS_MAX", "eight"), ("BB_LOADAVG_MAX", "4,5"),
+                           ("BB_RESOURCE_BUDGET", "cpu=4")]:
+            rq.cfgData.setVar(var, value)
+            self.assertRaises(bb.BBHandledException, self.setup_admission, rq)
+            rq.cfgData.delVar(var)
+
+    def test_no_limits(self):
+        rq, rqdata = self.make_runqueue(3)
+        self.assertEqual(rq.admission.max_active(), rq.number_tasks)
+        self.assertTrue(rq.admission.can_start(0))
+
+class StampIndexTest(SchedulerTestBase):
+    TASKS_PER_FILE = 2
+
+    def setUp(self):
+        SchedulerTestBase.setUp(self)
+        self.tempdir = tempfile.mkdtemp()
+        rq, self.rqdata = self.make_runqueue(4)
+        for fn in self.rqdata.taskData.fn_index:
+            self.rqdata.dataCache.stamp[fn] = os.path.join(self.tempdir, os.path.basename(fn), "1.0-r0")
+        self.index = bb.runqueue.RunQueueStampIndex(self.rqdata)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        SchedulerTestBase.tearDown(self)
+
+    def touch(self, path, mtime):
+        open(path, "w").close()
+        os.utime(path, (mtime, mtime))
+
+    def test_paths(self):
+        self.assertEqual(self.index.stampfile(1), os.path.join(self.tempdir, "recipe0.bb", "1.0-r0.do_task1"))
+        self.assertEqual(self.index.stampfile(2, "do_task0_setscene"), os.path.join(self.tempdir, "recipe1.bb", "1.0-r0.do_task0_setscene"))
+
+    def test_mtime_and_invalidate(self):
+        stamp0 = self.index.stampfile(0)
+        stamp1 = self.index.stampfile(1)
+        self.touch(stamp0, 1000)
+        self.assertEqual(self.index.mtime(stamp0), 1000)
+        self.assertIsNone(self.index.mtime(stamp1))
+
+        # Changes aren't seen until the directory is invalidated
+        self.touch(stamp0, 2000)
+        self.touch(stamp1, 3000)
+        self.assertEqual(self.index.mtime(stamp0), 1000)
+        self.assertIsNone(self.index.mtime(stamp1))
+        self.index.invalidate(1)
+        self.assertEqual(self.index.mtime(stamp0), 2000)
+        self.assertEqual(self.index.mtime(stamp1), 3000)
+
+    def test_missing_directory(self):
+        stamp = self.index.stampfile(3)
+        shutil.rmtree(os.path.dirname(stamp))
+        self.assertIsNone(self.index.mtime(stamp))
+
+class SchedulerSetupBenchmark(SchedulerTestBase):
+    """
+    Time scheduler construction on a large synthetic task graph. The limit
+    is deliberately generous; it only exists to catch quadratic behaviour.
+    """
+    NUMTASKS = 100000
+    LIMIT = 60
+
+    def benchmark(self, scheduler):
+        rq, rqdata = self.make_runqueue(self.NUMTASKS)
+        start = time.time()
+        sched = scheduler(rq, rqdata)
+        sched.next_buildable_task()
+        elapsed = time.time() - start
+        logger.info("Scheduler '%s' setup for %s tasks took %.2fs", scheduler.name, self.NUMTASKS, elapsed)
+        self.assertEqual(len(sched.prio_map), self.NUMTASKS)
+        self.assertLess(elapsed, self.LIMIT)
+
+    def test_basic_setup(self):
+        self.benchmark(bb.runqueue.RunQueueScheduler)
+
+    def test_speed_setup(self):
+        self.benchmark(bb.runqueue.RunQueueSchedulerSpeed)
+
+    def test_completion_setup(self):
+        self.benchmark(bb.runqueue.RunQueueSchedulerCompletion)
+
+    def test_critical_setup(self):
+        self.benchmark(bb.runqueue.RunQueueSchedulerCritical)
@@ -601,3 +601,40 @@ BBLAYERS += "/home/user/otherpath/layer6"
                                  ['/home/user/otherpath/layer6', '/home/user/path/layer3'], ['/home/user/path/layer1', '/home/user/path/layer4', '/home/user/path/layer7'],
                                  ['/home/user/path/layer3'],
                                  ['/home/user/path/layer7'])
+
+class Checksum(unittest.TestCase):
+
+    def _test_checksum(self, size):
+        import hashlib
+        data = os.urandom(size)
+        with tempfile.NamedTemporaryFile('wb') as tf:
+            tf.write(data)
+            tf.flush()
+            self.assertEqual(bb.utils.md5_file(tf.name), hashlib.md5(data).hexdigest())
+
+    def test_md5_small(self):
+        self._test_checksum(0)
+        self._test_checksum(1000)
+
+    def test_md5_mmap(self):
+        self._test_checksum(bb.utils.MMAP_CHECKSUM_THRESHOLD + 12345)
+
+    def _test_multi_hash(self, size):
+        import hashlib
+        data = os.urandom(size)
+        with tempfile.NamedTemporaryFile('wb') as tf:
+            tf.write(data)
+            tf.flush()
+            checksums = bb.utils.multi_hash_file(tf.name, ["md5", "sha1", "sha256"])
+            self.assertEqual(checksums, {"md5" : hashlib.md5(data).hexdigest(),
+                                         "sha1" : hashlib.sha1(data).hexdigest(),
+                                         "sha256" : hashlib.sha256(data).hexdigest()})
+            self.assertEqual(bb.utils.sha256_file(tf.name), checksums["sha256"])
+
+    def test_multi_hash_small(self):
+        self._test_multi_hash(0)
+        self._test_multi_hash(bb.utils.CHECKSUM_BLOCK_SIZE - 1)
+
+    def test_multi_hash_mmap(self):
+        self._test_multi_hash(bb.utils.MMAP_CHECKSUM_THRESHOLD)
+        self._test_multi_hash(bb.utils.CHECKSUM_BLOCK_SIZE * 3 + 12345)
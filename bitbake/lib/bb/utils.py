@@ -502,54 +502,58 @@ def unlockfile(lf):
     fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
     lf.close()
 
-def md5_file(filename):
+# Files at least this large are checksummed through mmap rather than read()
+MMAP_CHECKSUM_THRESHOLD = 1024 * 1024
+# Every hash is updated with a block of this size before moving on
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+def multi_hash_file(filename, algorithms):
     """
-    Return the hex string representation of the MD5 checksum of filename.
+    Return a dict mapping each of the hashlib algorithm names in algorithms
+    (e.g. "md5", "sha256") to the hex string representation of that checksum
+    of filename. The file is read only once, block by block, updating all
+    the checksums from each block while it is still in the CPU cache.
     """
-    try:
-        import hashlib
-        m = hashlib.md5()
-    except ImportError:
-        import md5
-        m = md5.new()
+    import hashlib
+    hashes = [(name, hashlib.new(name)) for name in algorithms]
 
     with open(filename, "rb") as f:
-        for line in f:
-            m.update(line)
-    return m.hexdigest()
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_CHECKSUM_THRESHOLD:
+            import mmap
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, CHECKSUM_BLOCK_SIZE):
+                    block = buffer(mm, offset, CHECKSUM_BLOCK_SIZE)
+                    for name, h in hashes:
+                        h.update(block)
+            finally:
+                mm.close()
+        else:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), ""):
+                for name, h in hashes:
+                    h.update(block)
+
+    return dict((name, h.hexdigest()) for name, h in hashes)
+
+def md5_file(filename):
+    """
+    Return the hex string representation of the MD5 checksum of filename.
+    """
+    return multi_hash_file(filename, ["md5"])["md5"]
 
 def sha256_file(filename):
     """
     Return the hex string representation of the 256-bit SHA checksum of
-    filename.  On Python 2.4 this will return None, so callers will need to
-    handle that by either skipping SHA checks, or running a standalone sha256sum
-    binary.
+    filename.
     """
-    try:
-        import hashlib
-    except ImportError:
-        return None
-
-    s = hashlib.sha256()
-    with open(filename, "rb") as f:
-        for line in f:
-            s.update(line)
-    return s.hexdigest()
+    return multi_hash_file(filename, ["sha256"])["sha256"]
 
 def sha1_file(filename):
     """
     Return the hex string representation of the SHA1 checksum of the filename
     """
-    try:
-        import hashlib
-    except ImportError:
-        return None
-
-    s = hashlib.sha1()
-    with open(filename, "rb") as f:
-        for line in f:
-            s.update(line)
-    return s.hexdigest()
+    return multi_hash_file(filename, ["sha1"])["sha1"]
 
 def preserved_envvars_exported():
     """Variables which are taken from the environment and placed in and exported
@@ -2,6 +2,7 @@ import logging
 import os.path
 import errno
 import prserv
+import threading
 import time
 
 try:
@@ -30,6 +31,9 @@ class PRTable(object):
         self.conn = conn
         self.nohist = nohist
         self.dirty = False
+        # The server handles requests from several threads over the one
+        # connection, hold this around anything which needs to be atomic
+        self.lock = threading.RLock()
         if nohist:
             self.table = "%s_nohist" % table 
         else:
@@ -55,13 +59,15 @@ class PRTable(object):
                 raise exc
 
     def sync(self):
-        self.conn.commit()
-        self._execute("BEGIN EXCLUSIVE TRANSACTION")
+        with self.lock:
+            self.conn.commit()
+            self._execute("BEGIN EXCLUSIVE TRANSACTION")
 
     def sync_if_dirty(self):
-        if self.dirty:
-            self.sync()
-            self.dirty = False
+        with self.lock:
+            if self.dirty:
+                self.sync()
+                self.dirty = False
 
     def _getValueHist(self, version, pkgarch, checksum):
         data=self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
@@ -118,10 +124,11 @@ class PRTable(object):
                 raise prserv.NotFoundError
 
     def getValue(self, version, pkgarch, checksum):
-        if self.nohist:
-            return self._getValueNohist(version, pkgarch, checksum)
-        else:
-            return self._getValueHist(version, pkgarch, checksum)
+        with self.lock:
+            if self.nohist:
+                return self._getValueNohist(version, pkgarch, checksum)
+            else:
+                return self._getValueHist(version, pkgarch, checksum)
 
     def _importHist(self, version, pkgarch, checksum, value):
         val = None 
@@ -172,12 +179,17 @@ class PRTable(object):
             return None
 
     def importone(self, version, pkgarch, checksum, value):
-        if self.nohist:
-            return self._importNohist(version, pkgarch, checksum, value)
-        else:
-            return self._importHist(version, pkgarch, checksum, value)
+        with self.lock:
+            if self.nohist:
+                return self._importNohist(version, pkgarch, checksum, value)
+            else:
+                return self._importHist(version, pkgarch, checksum, value)
 
     def export(self, version, pkgarch, checksum, colinfo):
+        with self.lock:
+            return self._export(version, pkgarch, checksum, colinfo)
+
+    def _export(self, version, pkgarch, checksum, colinfo):
         metainfo = {}
         #column info 
         if colinfo:
@@ -233,10 +245,11 @@ class PRTable(object):
 
     def dump_db(self, fd):
         writeCount = 0
-        for line in self.conn.iterdump():
-            writeCount = writeCount + len(line) + 1
-            fd.write(line)
-            fd.write('\n')
+        with self.lock:
+            for line in self.conn.iterdump():
+                writeCount = writeCount + len(line) + 1
+                fd.write(line)
+                fd.write('\n')
         return writeCount
 
 class PRData(object):
@@ -33,11 +33,15 @@ class Handler(SimpleXMLRPCRequestHandler):
         return value
 
 PIDPREFIX = "/tmp/PRServer_%s_%s.pid"
+HANDLER_THREADS = 4
 singleton = None
 
 
 class PRServer(SimpleXMLRPCServer):
-    def __init__(self, dbfile, logfile, interface, daemon=True):
+    # Many build machines may connect at once, don't drop their connections
+    request_queue_size = 128
+
+    def __init__(self, dbfile, logfile, interface, daemon=True, threads=HANDLER_THREADS):
         ''' constructor '''
         try:
             SimpleXMLRPCServer.__init__(self, interface,
@@ -57,6 +61,7 @@ class PRServer(SimpleXMLRPCServer):
         self.pidfile=PIDPREFIX % (self.host, self.port)
 
         self.register_function(self.getPR, "getPR")
+        self.register_function(self.getPRs, "getPRs")
         self.register_function(self.quit, "quit")
         self.register_function(self.ping, "ping")
         self.register_function(self.export, "export")
@@ -64,9 +69,15 @@ class PRServer(SimpleXMLRPCServer):
         self.register_function(self.importone, "importone")
         self.register_introspection_functions()
 
+        # Requests are handled by a pool of threads so that one slow client
+        # doesn't hold up the others, the database itself is serialised by
+        # the table lock
         self.requestqueue = Queue.Queue()
-        self.handlerthread = threading.Thread(target = self.process_request_thread)
-        self.handlerthread.daemon = False
+        self.handlerthreads = []
+        for i in range(max(threads, 1)):
+            thread = threading.Thread(target = self.process_request_thread)
+            thread.daemon = False
+            self.handlerthreads.append(thread)
 
     def process_request_thread(self):
         """Same as in BaseServer but as a thread.
@@ -82,10 +93,13 @@ class PRServer(SimpleXMLRPCServer):
 
         while not self.quit:
             try:
-                (request, client_address) = self.requestqueue.get(True, 30)
+                item = self.requestqueue.get(True, 30)
             except Queue.Empty:
                 self.table.sync_if_dirty()
                 continue
+            if item is None:
+                break
+            (request, client_address) = item
             try:
                 self.finish_request(request, client_address)
                 self.shutdown_request(request)
@@ -156,6 +170,15 @@ class PRServer(SimpleXMLRPCServer):
             logger.error(str(exc))
             return None
 
+    def getPRs(self, queries):
+        """
+        Look up a list of (version, pkgarch, checksum) queries within one
+        transaction, returning the list of values (None where getPR would
+        have returned None)
+        """
+        with self.table.lock:
+            return [self.getPR(version, pkgarch, checksum) for (version, pkgarch, checksum) in queries]
+
     def quit(self):
         self.quit=True
         return
@@ -173,10 +196,14 @@ class PRServer(SimpleXMLRPCServer):
         logger.info("Started PRServer with DBfile: %s, IP: %s, PORT: %s, PID: %s" %
                      (self.dbfile, self.host, self.port, str(os.getpid())))
 
-        self.handlerthread.start()
+        for thread in self.handlerthreads:
+            thread.start()
         while not self.quit:
             self.handle_request()
-        self.handlerthread.join()
+        for thread in self.handlerthreads:
+            self.requestqueue.put(None)
+        for thread in self.handlerthreads:
+            thread.join()
         self.db.disconnect()
         logger.info("PRServer: stopping...")
         self.server_close()
@@ -187,6 +214,7 @@ class PRServer(SimpleXMLRPCServer):
             pid = self.daemonize()
         else:
             pid = self.fork()
+        self.pid = pid
 
         # Ensure both the parent sees this and the child from the work_forever log entry above
         logger.info("Started PRServer with DBfile: %s, IP: %s, PORT: %s, PID: %s" %
@@ -304,6 +332,9 @@ class PRServerConnection(object):
     def getPR(self, version, pkgarch, checksum):
         return self.connection.getPR(version, pkgarch, checksum)
 
+    def getPRs(self, queries):
+        return self.connection.getPRs(queries)
+
     def ping(self):
         return self.connection.ping()
 
@@ -319,7 +350,7 @@ class PRServerConnection(object):
     def getinfo(self):
         return self.host, self.port
 
-def start_daemon(dbfile, host, port, logfile):
+def start_daemon(dbfile, host, port, logfile, threads=HANDLER_THREADS):
     ip = socket.gethostbyname(host)
     pidfile = PIDPREFIX % (ip, port)
     try:
@@ -334,7 +365,7 @@ def start_daemon(dbfile, host, port, logfile):
                             % pidfile)
         return 1
 
-    server = PRServer(os.path.abspath(dbfile), os.path.abspath(logfile), (ip,port))
+    server = PRServer(os.path.abspath(dbfile), os.path.abspath(logfile), (ip,port), threads=threads)
     server.start()
 
     # Sometimes, the port (i.e. localhost:0) indicated by the user does not match with
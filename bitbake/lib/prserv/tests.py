@@ -0,0 +1,80 @@
+# ex:ts=4:sw=4:sts=4:et
+# -*- tab-width: 4; c-basic-offset: 4; indent-tabs-mode: nil -*-
+#
+# BitBake Tests for the PR service (prserv/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import tempfile
+import threading
+import os
+import bb.utils
+import prserv.db
+import prserv.serv
+
+class PRTableTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = prserv.db.PRData(os.path.join(self.tempdir, "prserv.sqlite3"))
+        self.table = self.db["PRMAIN"]
+
+    def tearDown(self):
+        self.db.disconnect()
+        bb.utils.prunedir(self.tempdir)
+
+    def test_values(self):
+        self.assertEqual(self.table.getValue("1.0", "armv7", "a"), 0)
+        self.assertEqual(self.table.getValue("1.0", "armv7", "b"), 1)
+        self.assertEqual(self.table.getValue("1.0", "armv7", "b"), 1)
+        self.assertEqual(self.table.getValue("1.0", "x86", "c"), 0)
+
+    def test_threads(self):
+        # Concurrent lookups never hand out the same value twice
+        results = {}
+        def lookup(name):
+            for i in range(50):
+                checksum = "%s-%s" % (name, i)
+                results[checksum] = self.table.getValue("1.0", "armv7", checksum)
+
+        threads = [threading.Thread(target=lookup, args=(name,)) for name in "abcd"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results.values()), range(200))
+
+class PRServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.server = prserv.serv.PRServer(os.path.join(self.tempdir, "prserv.sqlite3"),
+                                           os.path.join(self.tempdir, "prserv.log"),
+                                           ("localhost", 0), daemon=False)
+        self.server.start()
+        self.server.socket.close()
+        host, port = self.server.getinfo()
+        self.connection = prserv.serv.PRServerConnection(host, port)
+
+    def tearDown(self):
+        self.connection.terminate()
+        os.waitpid(self.server.pid, 0)
+        bb.utils.prunedir(self.tempdir)
+
+    def test_getPRs(self):
+        self.assertTrue(self.connection.ping())
+        self.assertEqual(self.connection.getPR("1.0", "armv7", "a"), 0)
+        queries = [("1.0", "armv7", "a"), ("1.0", "armv7", "b"), ("2.0", "armv7", "a"), ("1.0", "armv7", "b")]
+        self.assertEqual(self.connection.getPRs(queries), [0, 1, 0, 1])
+        self.assertEqual(self.connection.getPR("1.0", "armv7", "c"), 2)
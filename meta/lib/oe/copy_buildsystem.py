@@ -203,7 +203,11 @@ def create_locked_sstate_cache(lockedsigs, input_sstate_cache, output_sstate_cac
     bb.note('Generating sstate-cache...')
 
     nativelsbstring = d.getVar('NATIVELSBSTRING', True)
-    bb.process.run("gen-lockedsig-cache %s %s %s %s" % (lockedsigs, input_sstate_cache, output_sstate_cache, nativelsbstring))
+    cmd = "gen-lockedsig-cache %s %s %s %s" % (lockedsigs, input_sstate_cache, output_sstate_cache, nativelsbstring)
+    if bb.utils.to_boolean(d.getVar('SSTATE_STORE', True), False):
+        # Copy the contents of stored objects along with their manifests
+        cmd += " %s" % d.getVar('SSTATE_STORE_DIR', True)
+    bb.process.run(cmd)
     if fixedlsbstring:
         nativedir = output_sstate_cache + '/' + nativelsbstring
         if os.path.isdir(nativedir):
@@ -0,0 +1,91 @@
+#
+# Index of the files installed into shared areas (sysroots, deploy
+# directories) by sstate tasks, mapping each file to the manifest of the
+# task which installed it. sstate_install uses it to find the owners of
+# files a task is about to overwrite without searching every manifest.
+#
+# The index is an sqlite database kept in the manifest directory, so it
+# goes away along with the manifests. An entry is only believed while the
+# manifest it names exists, manifests removed behind our back (or written
+# by an older version, before the index existed) don't cause bogus
+# conflicts.
+#
+
+import os
+import sqlite3
+
+INDEX = "owners.sqlite3"
+
+# Stay below sqlite's default limit on the number of query parameters
+BATCH = 500
+
+class OwnerIndex(object):
+    def __init__(self, manifestdir):
+        self.manifestdir = manifestdir
+        self.filename = os.path.join(manifestdir, INDEX)
+        self.connection = sqlite3.connect(self.filename, timeout=300, isolation_level=None)
+        self.connection.text_factory = str
+        self.connection.execute("CREATE TABLE IF NOT EXISTS owners(path TEXT PRIMARY KEY, manifest TEXT NOT NULL);")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS owners_manifest ON owners(manifest);")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS info(key TEXT PRIMARY KEY, value TEXT);")
+
+    def close(self):
+        self.connection.close()
+
+    def _populate(self):
+        """
+        Index the manifests written before the index was created, within
+        the caller's transaction
+        """
+        if self.connection.execute("SELECT value FROM info WHERE key='populated';").fetchone():
+            return
+        for name in os.listdir(self.manifestdir):
+            if not name.startswith("manifest-"):
+                continue
+            manifest = os.path.join(self.manifestdir, name)
+            with open(manifest) as f:
+                paths = [os.path.normpath(l.strip()) for l in f if l.strip() and not l.strip().endswith("/")]
+            self.connection.executemany("INSERT OR REPLACE INTO owners(path, manifest) VALUES (?, ?);",
+                                        ((path, manifest) for path in paths))
+        self.connection.execute("INSERT OR REPLACE INTO info(key, value) VALUES ('populated', '1');")
+
+    def _owners(self, paths):
+        owners = {}
+        for i in range(0, len(paths), BATCH):
+            batch = paths[i:i + BATCH]
+            query = "SELECT path, manifest FROM owners WHERE path IN (%s);" % ",".join("?" * len(batch))
+            owners.update(self.connection.execute(query, batch))
+        return owners
+
+    def claim(self, manifest, paths, shared=()):
+        """
+        Record manifest as the owner of paths, unless files already exist
+        at some of them which other manifests installed. In that case
+        nothing is recorded and a dict mapping those paths to the owning
+        manifests is returned. Paths starting with an entry of shared may
+        be installed by several manifests.
+        """
+        paths = sorted(set(os.path.normpath(p) for p in paths))
+        conflicts = {}
+        self.connection.execute("BEGIN IMMEDIATE;")
+        try:
+            self._populate()
+            for path, owner in self._owners(paths).items():
+                if owner == manifest or path.startswith(tuple(shared)):
+                    continue
+                if os.path.exists(owner) and os.path.lexists(path):
+                    conflicts[path] = owner
+            if not conflicts:
+                self.connection.executemany("INSERT OR REPLACE INTO owners(path, manifest) VALUES (?, ?);",
+                                            ((path, manifest) for path in paths))
+            self.connection.execute("COMMIT;")
+        except:
+            self.connection.execute("ROLLBACK;")
+            raise
+        return conflicts
+
+    def release(self, manifest):
+        """
+        Forget the paths owned by manifest, once its files are removed
+        """
+        self.connection.execute("DELETE FROM owners WHERE manifest=?;", (manifest,))
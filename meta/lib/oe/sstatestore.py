@@ -0,0 +1,195 @@
+#
+# Content addressed storage of sstate objects
+#
+# Instead of an archive, an sstate object can be a manifest of the files it
+# holds, with the file contents kept once in a store shared by all objects.
+# Store entries are named after the sha256 of the content and the file mode
+# ("<sha256>-<octal mode>") and kept in subdirectories named after the
+# first two characters. Manifests are text files with one tab separated
+# line per member after a header line:
+#
+#   d <mode> <path>
+#   f <mode> <key> <path>
+#   l <target> <path>
+#
+# Paths are relative to the packaged tree. Members are restored by
+# hardlinking or reflinking (falling back to copying) store entries. With
+# hardlinks the installed files *are* the store entries, so nothing may
+# modify them in place.
+#
+# Writers hold a shared lock on the store from adding the first entry until
+# their manifest is in place, garbage collection holds it exclusively so it
+# never sees entries whose manifest doesn't exist yet.
+#
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+
+HEADER = "# sstate store manifest 1"
+LOCK = "lock"
+
+# The FICLONE ioctl, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+class ManifestError(Exception):
+    pass
+
+def lock_store(store, exclusive=False):
+    """
+    Lock store, shared when adding entries and exclusively to remove them.
+    Returns the file descriptor of the lock, closing it releases the lock.
+    """
+    try:
+        os.makedirs(store)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    # Read only so the lock works for all users of a shared store
+    fd = os.open(os.path.join(store, LOCK), os.O_RDONLY | os.O_CREAT, 0o666)
+    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return fd
+
+def entry_path(store, key):
+    return os.path.join(store, key[:2], key)
+
+def file_key(path, mode):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            h.update(data)
+    return "%s-%o" % (h.hexdigest(), stat.S_IMODE(mode))
+
+def _add(store, key, path):
+    """
+    Add the file at path to the store as key unless it's already there
+    """
+    entry = entry_path(store, key)
+    if os.path.exists(entry):
+        return
+    try:
+        os.makedirs(os.path.dirname(entry))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    tmp = "%s.tmp.%s" % (entry, os.getpid())
+    shutil.copy2(path, tmp)
+    os.rename(tmp, entry)
+
+def store_tree(srcdir, manifest, store):
+    """
+    Add the contents of srcdir to store and write a manifest of them to
+    manifest. Returns the number of files and how many of them were already
+    in the store.
+    """
+    lock = lock_store(store)
+    try:
+        return _store_tree(srcdir, manifest, store)
+    finally:
+        os.close(lock)
+
+def _store_tree(srcdir, manifest, store):
+    lines = []
+    files = 0
+    known = 0
+    for walkroot, dirs, filenames in os.walk(srcdir):
+        dirs.sort()
+        for name in dirs + sorted(filenames):
+            path = os.path.join(walkroot, name)
+            rel = os.path.relpath(path, srcdir)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                lines.append("l\t%s\t%s" % (os.readlink(path), rel))
+            elif stat.S_ISDIR(st.st_mode):
+                lines.append("d\t%o\t%s" % (stat.S_IMODE(st.st_mode), rel))
+            elif stat.S_ISREG(st.st_mode):
+                key = file_key(path, st.st_mode)
+                files = files + 1
+                if os.path.exists(entry_path(store, key)):
+                    known = known + 1
+                _add(store, key, path)
+                lines.append("f\t%o\t%s\t%s" % (stat.S_IMODE(st.st_mode), key, rel))
+            else:
+                raise ManifestError("%s is not a regular file, directory or symlink" % path)
+
+    tmp = "%s.tmp.%s" % (manifest, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(HEADER + "\n")
+        for line in lines:
+            f.write(line + "\n")
+    os.chmod(tmp, 0o664)
+    os.rename(tmp, manifest)
+    return files, known
+
+def read_manifest(manifest):
+    """
+    Return the members of a manifest as (type, fields...) tuples
+    """
+    with open(manifest) as f:
+        if f.readline().rstrip("\n") != HEADER:
+            raise ManifestError("%s is not an sstate store manifest" % manifest)
+        return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+def referenced(manifest):
+    """
+    Return the store keys a manifest refers to
+    """
+    return set(member[2] for member in read_manifest(manifest) if member[0] == "f")
+
+def _reflink(src, dst):
+    with open(src, "rb") as s:
+        with open(dst, "wb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except IOError:
+                # Not supported by the filesystem, or across filesystems
+                shutil.copyfileobj(s, d)
+    shutil.copystat(src, dst)
+
+def restore_tree(manifest, store, destdir, link="reflink", verify=False):
+    """
+    Recreate the tree described by manifest in destdir from the store,
+    hardlinking ("hardlink") or reflinking ("reflink") the files. Both fall
+    back to copying where they aren't possible. With verify, the restored
+    files are checked against their keys.
+    """
+    members = read_manifest(manifest)
+    missing = [m[2] for m in members if m[0] == "f" and not os.path.exists(entry_path(store, m[2]))]
+    if missing:
+        raise ManifestError("%d files of %s are missing from the store %s, e.g. %s" % (len(missing), manifest, store, missing[0]))
+
+    if not os.path.isdir(destdir):
+        os.makedirs(destdir)
+    dirs = []
+    for member in members:
+        path = os.path.join(destdir, member[-1])
+        if member[0] == "d":
+            os.mkdir(path)
+            dirs.append((path, int(member[1], 8)))
+        elif member[0] == "l":
+            os.symlink(member[1], path)
+        elif member[0] == "f":
+            entry = entry_path(store, member[2])
+            linked = False
+            if link == "hardlink":
+                try:
+                    os.link(entry, path)
+                    linked = True
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                        raise
+            if not linked:
+                _reflink(entry, path)
+            if verify and file_key(path, int(member[1], 8)) != member[2]:
+                raise ManifestError("%s restored from %s doesn't match its checksum, the store entry %s is corrupt" % (path, manifest, entry))
+        else:
+            raise ManifestError("Unknown member type %s in %s" % (member[0], manifest))
+    # Directory modes last, they may not be writable
+    for path, mode in reversed(dirs):
+        os.chmod(path, mode)
@@ -0,0 +1,75 @@
+import unittest
+import oe, oe.sstateowners
+import tempfile
+import os
+import shutil
+
+class TestOwnerIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstateowners")
+        self.manifestdir = os.path.join(self.tmpdir, "sstate-control")
+        self.sysroot = os.path.join(self.tmpdir, "sysroot")
+        os.makedirs(self.manifestdir)
+        os.makedirs(self.sysroot)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def install(self, name, files):
+        """
+        Claim files for the manifest name, writing the manifest and the files
+        if there are no conflicts, as sstate_install does
+        """
+        manifest = os.path.join(self.manifestdir, "manifest-x86-%s.populate_sysroot" % name)
+        paths = [os.path.join(self.sysroot, f) for f in files]
+        owners = oe.sstateowners.OwnerIndex(self.manifestdir)
+        conflicts = owners.claim(manifest, paths, [os.path.join(self.sysroot, "shared/")])
+        owners.close()
+        if not conflicts:
+            with open(manifest, "w") as f:
+                for path in paths:
+                    open(path, "w").close()
+                    f.write(path + "\n")
+        return dict((os.path.relpath(p, self.sysroot), os.path.basename(m)) for p, m in conflicts.items())
+
+    def release(self, name):
+        manifest = os.path.join(self.manifestdir, "manifest-x86-%s.populate_sysroot" % name)
+        os.remove(manifest)
+        owners = oe.sstateowners.OwnerIndex(self.manifestdir)
+        owners.release(manifest)
+        owners.close()
+
+    def test_conflicts(self):
+        self.assertEqual(self.install("a", ["a1", "common"]), {})
+        self.assertEqual(self.install("b", ["b1", "common", "a1"]),
+                         {"common": "manifest-x86-a.populate_sysroot",
+                          "a1": "manifest-x86-a.populate_sysroot"})
+        # Nothing was claimed for b
+        self.assertEqual(self.install("c", ["b1"]), {})
+
+    def test_release(self):
+        self.assertEqual(self.install("a", ["common"]), {})
+        self.release("a")
+        self.assertEqual(self.install("b", ["common"]), {})
+
+    def test_stale(self):
+        self.assertEqual(self.install("a", ["a1", "a2"]), {})
+        # Neither removed files nor removed manifests conflict
+        os.remove(os.path.join(self.sysroot, "a1"))
+        self.assertEqual(self.install("b", ["a1"]), {})
+        os.remove(os.path.join(self.manifestdir, "manifest-x86-a.populate_sysroot"))
+        self.assertEqual(self.install("c", ["a2"]), {})
+
+    def test_shared(self):
+        os.makedirs(os.path.join(self.sysroot, "shared"))
+        self.assertEqual(self.install("a", ["shared/f"]), {})
+        self.assertEqual(self.install("b", ["shared/f"]), {})
+
+    def test_existing_manifests(self):
+        # Manifests written before the index existed are indexed on first use
+        manifest = os.path.join(self.manifestdir, "manifest-x86-old.populate_sysroot")
+        with open(manifest, "w") as f:
+            f.write(os.path.join(self.sysroot, "old") + "\n")
+            f.write(self.sysroot + "/\n")
+        open(os.path.join(self.sysroot, "old"), "w").close()
+        self.assertEqual(self.install("a", ["old"]), {"old": "manifest-x86-old.populate_sysroot"})
@@ -0,0 +1,95 @@
+import unittest
+import oe, oe.sstatestore
+import tempfile
+import os
+import shutil
+import stat
+
+class TestSstateStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="oe-test_sstatestore")
+        self.store = os.path.join(self.tmpdir, "store")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def maketree(self, name, files):
+        tree = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.join(tree, "usr/include"))
+        os.makedirs(os.path.join(tree, "usr/bin"))
+        os.makedirs(os.path.join(tree, "empty"))
+        for path, content in files.items():
+            with open(os.path.join(tree, path), "w") as f:
+                f.write(content)
+        os.symlink("../include", os.path.join(tree, "usr/bin/link"))
+        return tree
+
+    def contents(self, tree):
+        result = {}
+        for root, dirs, files in os.walk(tree):
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, tree)
+                st = os.lstat(path)
+                if stat.S_ISLNK(st.st_mode):
+                    result[rel] = ("l", os.readlink(path))
+                elif stat.S_ISDIR(st.st_mode):
+                    result[rel] = ("d", stat.S_IMODE(st.st_mode))
+                else:
+                    result[rel] = ("f", stat.S_IMODE(st.st_mode), open(path).read())
+        return result
+
+    def test_roundtrip(self):
+        for link in ["reflink", "hardlink"]:
+            tree = self.maketree("tree-" + link, {"usr/include/a.h": "a", "usr/bin/tool": "#!/bin/sh\n"})
+            os.chmod(os.path.join(tree, "usr/bin/tool"), 0o755)
+            manifest = os.path.join(self.tmpdir, "object-%s.store" % link)
+            oe.sstatestore.store_tree(tree, manifest, self.store)
+            dest = os.path.join(self.tmpdir, "dest-" + link)
+            oe.sstatestore.restore_tree(manifest, self.store, dest, link)
+            self.assertEqual(self.contents(tree), self.contents(dest))
+
+    def test_dedup(self):
+        tree1 = self.maketree("tree1", {"usr/include/a.h": "shared", "usr/include/b.h": "one"})
+        tree2 = self.maketree("tree2", {"usr/include/a.h": "shared", "usr/include/c.h": "one"})
+        m1 = os.path.join(self.tmpdir, "1.store")
+        m2 = os.path.join(self.tmpdir, "2.store")
+        self.assertEqual(oe.sstatestore.store_tree(tree1, m1, self.store), (2, 0))
+        self.assertEqual(oe.sstatestore.store_tree(tree2, m2, self.store), (2, 2))
+        self.assertEqual(oe.sstatestore.referenced(m1), oe.sstatestore.referenced(m2))
+        self.assertEqual(len(oe.sstatestore.referenced(m1)), 2)
+
+    def test_missing(self):
+        tree = self.maketree("tree", {"usr/include/a.h": "a"})
+        manifest = os.path.join(self.tmpdir, "object.store")
+        oe.sstatestore.store_tree(tree, manifest, self.store)
+        for key in oe.sstatestore.referenced(manifest):
+            os.unlink(oe.sstatestore.entry_path(self.store, key))
+        self.assertRaises(oe.sstatestore.ManifestError, oe.sstatestore.restore_tree,
+                          manifest, self.store, os.path.join(self.tmpdir, "dest"))
+
+    def test_verify(self):
+        tree = self.maketree("tree", {"usr/include/a.h": "a"})
+        manifest = os.path.join(self.tmpdir, "object.store")
+        oe.sstatestore.store_tree(tree, manifest, self.store)
+        oe.sstatestore.restore_tree(manifest, self.store, os.path.join(self.tmpdir, "dest1"), verify=True)
+        for key in oe.sstatestore.referenced(manifest):
+            with open(oe.sstatestore.entry_path(self.store, key), "w") as f:
+                f.write("corrupt")
+        self.assertRaises(oe.sstatestore.ManifestError, oe.sstatestore.restore_tree,
+                          manifest, self.store, os.path.join(self.tmpdir, "dest2"), verify=True)
+
+    def test_lock(self):
+        import fcntl
+        shared = oe.sstatestore.lock_store(self.store)
+        try:
+            # Writers share the lock, garbage collection has to wait for them
+            os.close(oe.sstatestore.lock_store(self.store))
+            fd = os.open(os.path.join(self.store, oe.sstatestore.LOCK), os.O_RDONLY)
+            try:
+                self.assertRaises(IOError, fcntl.flock, fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            finally:
+                os.close(fd)
+        finally:
+            os.close(shared)
+        os.close(oe.sstatestore.lock_store(self.store, exclusive=True))
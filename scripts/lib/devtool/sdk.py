@@ -59,10 +59,11 @@ def get_sstate_objects(update_dict, sstate_dir):
     for k in update_dict:
         files = set()
         hashval = update_dict[k]
-        p = sstate_dir + '/' + hashval[:2] + '/*' + hashval + '*.tgz'
-        files |= set(glob.glob(p))
-        p = sstate_dir + '/*/' + hashval[:2] + '/*' + hashval + '*.tgz'
-        files |= set(glob.glob(p))
+        for ext in ['tgz', 'tar.zst', 'tar.lz4']:
+            p = sstate_dir + '/' + hashval[:2] + '/*' + hashval + '*.' + ext
+            files |= set(glob.glob(p))
+            p = sstate_dir + '/*/' + hashval[:2] + '/*' + hashval + '*.' + ext
+            files |= set(glob.glob(p))
         files = list(files)
         if len(files) == 1:
             sstate_objects.extend(files)